@@ -0,0 +1,153 @@
+"""
+Sparse storage of base calculations: one row per occupied grid cell and asset (grid_number, asset, value), in COO-style.
+Grid cells without infrastructure are not stored, so memory and file size scale with the number of occupied grid cells instead of the size of the grid.
+Stores can be summed (e.g. over areas), joined with grid data and densified to a dataframe with one column per asset when needed.
+"""
+
+import numpy as np
+import pandas as pd
+
+STORE_COLUMNS = ['grid_number', 'asset', 'value']
+
+def empty_cellstore():
+    """empty sparse store
+
+    Returns:
+        pd with columns grid_number, asset and value without rows
+    """
+    return pd.DataFrame({'grid_number': np.zeros(0, dtype=np.int64),
+                         'asset': pd.Categorical([]),
+                         'value': np.zeros(0, dtype=np.float64)})
+
+def from_table(grid_numbers, table, columns):
+    """make sparse store from an array with base calculations
+    Arguments:
+        *grid_numbers*: array with the grid number of each row in *table*
+        *table*: array with base calculations (grid cells as rows)
+        *columns*: list with the column names (assets) of *table*
+
+    Returns:
+        pd with the non-zero values of *table* as rows (grid_number, asset, value)
+    """
+    table = np.asarray(table, dtype=np.float64)
+    rows, cols = np.nonzero(table)
+
+    return pd.DataFrame({'grid_number': np.asarray(grid_numbers, dtype=np.int64)[rows],
+                         'asset': pd.Categorical.from_codes(cols, categories=list(columns)),
+                         'value': table[rows, cols]})
+
+def to_cellstore(df, columns=None):
+    """make sparse store from a dataframe with base calculations per grid
+    Arguments:
+        *df*: pd with base calculations per grid, containing the column grid_number
+        *columns*: list with the columns that need to be stored. Optional, by default all columns ending with _count, _km or _km2
+
+    Returns:
+        pd with the non-zero values of *df* as rows (grid_number, asset, value)
+    """
+    if columns is None:
+        columns = [col for col in df.columns if col.endswith(('_count', '_km', '_km2'))]
+    if df.empty or len(columns) == 0:
+        return empty_cellstore()
+
+    return from_table(df['grid_number'].values, df[columns].to_numpy(dtype=np.float64), columns)
+
+def sum_cellstores(stores):
+    """sum sparse stores (e.g. of multiple areas) per grid cell and asset
+    Arguments:
+        *stores*: list with sparse stores
+
+    Returns:
+        pd with one row per grid cell and asset (grid_number, asset, value)
+    """
+    stores = [store for store in stores if not store.empty]
+    if len(stores) == 0:
+        return empty_cellstore()
+
+    combined = pd.concat([store.astype({'asset': str}) for store in stores], ignore_index=True)
+    summed = combined.groupby(['grid_number', 'asset'], as_index=False, sort=True)['value'].sum()
+    summed['asset'] = summed['asset'].astype('category')
+
+    return summed[STORE_COLUMNS]
+
+def empty_table(grid_data, columns):
+    """preallocated table to accumulate sparse stores in
+    Arguments:
+        *grid_data*: pd with grids, its index corresponds to the grid numbers
+        *columns*: list with the assets that are the columns of the table
+
+    Returns:
+        array of zeros with a row per grid in *grid_data* and a column per asset in *columns*
+    """
+    return np.zeros((len(grid_data), len(columns)), dtype=np.float64)
+
+def add_to_table(table, store, grid_data, columns):
+    """add a sparse store to a (preallocated) table in place, so stores of multiple areas can be accumulated one at a time
+    Arguments:
+        *table*: array with a row per grid in *grid_data* and a column per asset in *columns*
+        *store*: sparse store (grid_number, asset, value)
+        *grid_data*: pd with grids, its index corresponds to the grid numbers in *store*
+        *columns*: list with the assets that are the columns of *table*
+
+    Returns:
+        *table* with the values of *store* added
+    """
+    if store.empty:
+        return table
+
+    column_index = pd.Index(columns).get_indexer(store['asset'].astype(str))
+    row_index = grid_data.index.get_indexer(store['grid_number'].values)
+    keep = (column_index >= 0) & (row_index >= 0) #assets that are not requested and grids that are not in grid_data are skipped
+    np.add.at(table, (row_index[keep], column_index[keep]), store['value'].values[keep])
+
+    return table
+
+def table_to_dataframe(table, grid_data, columns):
+    """join a table with values per grid and asset with grid data
+    Arguments:
+        *table*: array with a row per grid in *grid_data* and a column per asset in *columns*
+        *grid_data*: pd with grids
+        *columns*: list with the assets that are the columns of *table*
+
+    Returns:
+        *grid_data* with a float column per asset placed before the columns of *grid_data*
+    """
+    return pd.concat([pd.DataFrame(table, columns=columns, index=grid_data.index), grid_data], axis=1)
+
+def densify(store, grid_data, columns=None):
+    """join a sparse store with grid data to get a dataframe with one column per asset
+    Arguments:
+        *store*: sparse store (grid_number, asset, value)
+        *grid_data*: pd with grids, its index corresponds to the grid numbers in *store*
+        *columns*: list with the assets that are made into columns (missing assets get zeros). Optional, by default all assets in *store*
+
+    Returns:
+        *grid_data* with a float column per asset placed before the columns of *grid_data* (zero for grid cells not in *store*)
+    """
+    if columns is None:
+        columns = list(pd.unique(store['asset'].astype(str)))
+
+    table = add_to_table(empty_table(grid_data, columns), store, grid_data, columns)
+
+    return table_to_dataframe(table, grid_data, columns)
+
+def save_cellstore(store, path):
+    """save sparse store as feather file
+    Arguments:
+        *store*: sparse store (grid_number, asset, value)
+        *path*: path to output file
+    """
+    store[STORE_COLUMNS].reset_index(drop=True).to_feather(path)
+
+def load_cellstore(path):
+    """load sparse store from feather file
+    Arguments:
+        *path*: path to feather file with sparse store
+
+    Returns:
+        pd with sparse store (grid_number, asset, value)
+    """
+    store = pd.read_feather(path)
+    store['asset'] = store['asset'].astype('category')
+
+    return store[STORE_COLUMNS]
@@ -4,22 +4,23 @@
 @Author: Sadhana Nirandjan & Elco Koks  - Institute for Environmental studies, VU University Amsterdam
 """
 import numpy as np
+import pandas as pd
 import geopandas as gpd
 from tqdm import tqdm
 
-#import functions for line_length
-from boltons.iterutils import pairwise 
-#from geopy.distance import geodesic
-
 #import functions for polygon_area
 import pyproj  #and for convert_crs
 import shapely.ops as ops
 from shapely.geometry.polygon import Polygon
-from functools import partial
+from functools import partial, lru_cache
 
 #import functions for clip_pygeos
 import pygeos
 
+#import functions for regular grids and geodesic measurements
+import gridmaker
+import geodesic
+
 
 ########################################################################################################################
 ################          Fast codes using pygeos          #############################################################
@@ -44,6 +45,61 @@ def clip_pygeos(df1,df2,spat_tree,reset_index=False):
 
     return df1
 
+def mask_query(mask,spat_tree):
+    """get the geometries in a spatial tree that intersect a subdivided mask
+    Arguments:
+        *mask: dataframe with pieces of a mask, e.g. a country (see gridmaker.subdivide_mask)
+        *spat_tree: spatial tree with coordinates in pygeos format
+        
+    Returns:
+        sorted array with the positions of the geometries in *spat_tree* that intersect the mask
+    """
+    return np.unique(spat_tree.query_bulk(mask.geometry.values,predicate='intersects')[1])
+
+def clip_to_mask(df1,mask,geometry,reset_index=False):
+    """fast clipping using a subdivided mask: features within interior tiles of the mask are kept as they are, features within one boundary tile are clipped with the (small) piece of the mask in that tile, 
+    and only features crossing a boundary tile and other tiles are clipped with the whole mask
+    Arguments:
+        *df1: dataframe with spatial data to be clipped
+        *mask: dataframe with pieces of *geometry* and the bounds of their tiles (see gridmaker.subdivide_mask)
+        *geometry: mask in pygeos geometry, e.g. the polygon of a country
+        
+    Returns:
+        dataframe with coordinates in pygeos geometry
+    """
+    geoms = df1.geometry.values
+    pieces = mask.geometry.values
+    tiles = pygeos.box(mask.xmin.values, mask.ymin.values, mask.xmax.values, mask.ymax.values)
+
+    #tiles are tested per (connected) part of the features: a part that only intersects interior tiles cannot leave them without intersecting a neighbouring tile, 
+    #since all neighbours of interior tiles are part of the mask. So features only intersecting interior tiles are within *geometry* 
+    parts, part_feature = pygeos.get_parts(geoms, return_index=True)
+    part_index, tile_index = pygeos.STRtree(tiles).query_bulk(parts,predicate='intersects')
+    pairs = np.unique(part_feature[part_index] * len(tiles) + tile_index) #distinct feature/tile combinations
+    feature_index, tile_index = pairs // len(tiles), pairs % len(tiles)
+
+    n_tiles = np.bincount(feature_index, minlength=len(df1))
+    n_boundary = np.bincount(feature_index, weights=~mask.interior.values[tile_index], minlength=len(df1))
+    outside = np.bincount(part_feature, weights=np.bincount(part_index, minlength=len(parts)) == 0, minlength=len(df1)) > 0 #features with parts outside of the tiles
+    single = np.zeros(len(df1), dtype=np.int64)
+    single[feature_index] = tile_index #the tile of features that intersect one tile
+
+    #parts outside of the tiles are outside of *geometry*, so features intersecting one (boundary) tile can be clipped with the piece of that tile
+    clipped = geoms.copy()
+    one_boundary = (n_tiles == 1) & (n_boundary == 1) 
+    clipped[one_boundary] = pygeos.intersection(geoms[one_boundary], pieces[single[one_boundary]])
+    crossing = (n_tiles > 0) & ~one_boundary & ((n_boundary > 0) | outside)
+    clipped[crossing] = pygeos.intersection(geoms[crossing], geometry)
+
+    keep = (n_tiles > 0) & ~pygeos.is_empty(clipped)
+    df1 = df1.loc[keep]
+    df1['geometry'] = clipped[keep]
+
+    if reset_index==True:
+        df1.reset_index(drop=True,inplace=True)
+
+    return df1
+
 def clip_pygeos2(gdf1,gdf2,spat_tree,reset_index=False):
     """fast clipping using pygeos, avoiding errors due to self-intersection (while clipping multipolygons)
     Arguments:
@@ -66,6 +122,30 @@ def clip_pygeos2(gdf1,gdf2,spat_tree,reset_index=False):
     
     return gdf1.drop(columns=['pygeos_geom'])
 
+@lru_cache(maxsize=128)
+def get_transformer(source_crs, target_crs):
+    """get transformer between two crs, cached so that each transformer is only created once per process
+    Arguments:
+        *source_crs*: crs of the input coordinates (e.g. "epsg:4326")
+        *target_crs*: crs of the output coordinates (e.g. "epsg:32631")
+        
+    Returns:
+        pyproj Transformer with x,y (lon,lat) axis order
+    """
+    return pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+def utm_epsg(lon, lat):
+    """epsg code of the UTM zone for geographic coordinates
+    Arguments:
+        *lon*: (array with) longitude(s)
+        *lat*: (array with) latitude(s)
+        
+    Returns:
+        (array with) epsg code(s) as integers
+    """
+    # formula below based on :https://gis.stackexchange.com/a/190209/80697 
+    return (32700-np.round((45+np.asarray(lat))/90,0)*100+np.round((183+np.asarray(lon))/6,0)).astype(np.int64)
+
 def convert_crs(geom_series):
     """convert crs to other projection to enable spatial calculations with length and areas
     Arguments:
@@ -82,16 +162,40 @@ def convert_crs(geom_series):
     #current_crs = str(current_crs[0])
     lat = pygeos.geometry.get_y(pygeos.centroid(geom_series[0]))
     lon = pygeos.geometry.get_x(pygeos.centroid(geom_series[0]))
-    # formula below based on :https://gis.stackexchange.com/a/190209/80697 
-    approximate_crs = "epsg:" + str(int(32700-np.round((45+lat)/90,0)*100+np.round((183+lon)/6,0)))
+    approximate_crs = "epsg:" + str(utm_epsg(lon, lat))
     #from pygeos/issues/95
     geometries = list(geom_series)
     coords = pygeos.get_coordinates(geometries)
-    transformer=pyproj.Transformer.from_crs(current_crs, approximate_crs,always_xy=True)
+    transformer=get_transformer(current_crs, approximate_crs)
     new_coords = transformer.transform(coords[:, 0], coords[:, 1])
     
     return pygeos.set_coordinates(geometries.copy(), np.array(new_coords).T)
 
+def convert_crs_per_zone(geom_series, epsg=None):
+    """convert crs of each geometry to a UTM zone, with one transformation per zone (batched version of convert_crs)
+    Arguments:
+        *geom_series*: series with geographic coordinates in Pygeos format
+        *epsg*: array with epsg code of the UTM zone for each geometry. Optional, the zone of the centroid of each geometry is used when not given
+        
+    Returns:
+        array with coordinates in the UTM zone of each geometry
+    """
+    current_crs="epsg:4326"
+    geometries = np.array(list(geom_series), dtype=object)
+    if epsg is None:
+        centroids = pygeos.centroid(geometries)
+        epsg = utm_epsg(pygeos.get_x(centroids), pygeos.get_y(centroids))
+
+    coords, geometry_index = pygeos.get_coordinates(geometries, return_index=True)
+    coords_epsg = np.asarray(epsg)[geometry_index] #zone of each coordinate
+    new_coords = np.empty_like(coords)
+    for zone in np.unique(coords_epsg): #one transformation for all geometries in a zone
+        in_zone = coords_epsg == zone
+        transformer = get_transformer(current_crs, "epsg:{}".format(zone))
+        new_coords[in_zone, 0], new_coords[in_zone, 1] = transformer.transform(coords[in_zone, 0], coords[in_zone, 1])
+
+    return pygeos.set_coordinates(geometries, new_coords)
+
 def line_length_pygeos(geom_series):
     """length per asset in meters
     Arguments:
@@ -101,7 +205,7 @@ def line_length_pygeos(geom_series):
         Serie with length in meters
     """
 #    return pygeos.length((geom_series))
-    return pygeos.length(convert_crs(geom_series))
+    return pygeos.length(convert_crs_per_zone(geom_series))
 
 def polygon_area_pygeos(geom_series):
     """area per asset in m2
@@ -111,13 +215,270 @@ def polygon_area_pygeos(geom_series):
     Returns:
         Serie with area in m2
     """  
-    return pygeos.area(convert_crs(geom_series))
+    return pygeos.area(convert_crs_per_zone(geom_series))
+
+def grid_asset_pairs(infra_dataset, df_store, spat_tree=None):
+    """clip all assets with all grid cells at once (bulk version of clip_pygeos)
+    Arguments:
+        *infra_dataset* : a pd with WGS-84 coordinates in Pygeos 
+        *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *spat_tree* : spatial tree of the grid cells in *df_store*. Optional, it is created when not given
+        
+    Returns:
+        pd with one row per intersecting grid cell and asset: position of the grid cell in *df_store* (cell), assettype (asset) and clipped geometry (geometry)
+    """
+    if spat_tree is None: spat_tree = pygeos.STRtree(df_store.geometry) # https://pygeos.readthedocs.io/en/latest/strtree.html
+    asset_index, cell_index = spat_tree.query_bulk(infra_dataset.geometry, predicate='intersects') #one query for all assets
+    
+    pairs = pd.DataFrame({'cell': cell_index,
+                          'asset': infra_dataset.asset.values[asset_index],
+                          'geometry': pygeos.intersection(infra_dataset.geometry.values[asset_index], df_store.geometry.values[cell_index])}) #clip each asset with each grid cell it overlaps
+    
+    return pairs.loc[~pygeos.is_empty(pairs.geometry)].reset_index(drop=True)
+
+def points_per_grid(infra_dataset, lattice):
+    """assign point assets to the grid cell they are located in by arithmetic on a regular lattice, without spatial tree and clipping
+    Arguments:
+        *infra_dataset* : a pd with WGS-84 point coordinates in Pygeos 
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice)
+        
+    Returns:
+        pd with one row per point located in a grid cell: position of the grid cell (cell) and assettype (asset)
+    """
+    cells = gridmaker.lattice_cell(pygeos.get_x(infra_dataset.geometry.values), pygeos.get_y(infra_dataset.geometry.values), lattice)
+    located = cells >= 0 #points outside the grid cells are not counted
+
+    return pd.DataFrame({'cell': cells[located], 'asset': infra_dataset.asset.values[located]})
+
+def lines_per_grid(infra_dataset, lattice, chunk_size=1000000):
+    """geodesic length of line assets per grid cell on a regular lattice, by splitting all line segments where they cross the rows and columns of the lattice (without spatial tree and clipping)
+    Arguments:
+        *infra_dataset* : a pd with WGS-84 (multi)linestring coordinates in Pygeos 
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice)
+        *chunk_size* : maximum number of line parts that are split at once, to limit memory use
+        
+    Returns:
+        pd with one row per asset and grid cell it crosses: position of the grid cell (cell), assettype (asset) and length in km (length_km)
+    """
+    xmin, ymax, height = lattice['xmin'], lattice['ymax'], lattice['height']
+    parts, asset_index = pygeos.get_parts(infra_dataset.geometry.values, return_index=True) #split multilinestrings in linestrings
+
+    pieces = []
+    for start in range(0, len(parts), chunk_size):
+        coords, part_index = pygeos.get_coordinates(parts[start:start+chunk_size], return_index=True)
+        segment = part_index[1:] == part_index[:-1] #consecutive coordinates of the same part form a segment
+        x0, y0 = coords[:-1,0][segment], coords[:-1,1][segment]
+        x1, y1 = coords[1:,0][segment], coords[1:,1][segment]
+        segment_asset = asset_index[start:start+chunk_size][part_index[:-1][segment]]
+        n_segments = len(x0)
+
+        #position of the start and end of each segment in lattice units (columns and rows)
+        u0, u1 = (x0 - xmin)/height, (x1 - xmin)/height
+        v0, v1 = (ymax - y0)/height, (ymax - y1)/height
+
+        #relative position along the segment (t) of each crossing with a column or row boundary (DDA traversal)
+        t_split, id_split = [np.zeros(n_segments), np.ones(n_segments)], [np.arange(n_segments), np.arange(n_segments)]
+        for a0, a1 in ((u0, u1), (v0, v1)):
+            first = np.floor(np.minimum(a0, a1)) + 1 #first boundary after the start of the segment
+            n_cross = np.maximum(np.ceil(np.maximum(a0, a1)) - first, 0).astype(np.int64) #number of boundaries crossed
+            ids = np.repeat(np.arange(n_segments), n_cross)
+            boundary = first[ids] + (np.arange(len(ids)) - np.repeat(np.cumsum(n_cross) - n_cross, n_cross))
+            t_split.append((boundary - a0[ids]) / (a1[ids] - a0[ids]))
+            id_split.append(ids)
+        t_split, id_split = np.concatenate(t_split), np.concatenate(id_split)
+        order = np.lexsort((t_split, id_split))
+        t_split, id_split = t_split[order], id_split[order]
+
+        #sub-segments between consecutive splits of the same segment, assigned to the grid cell of their midpoint
+        same = (id_split[1:] == id_split[:-1]) & (t_split[1:] > t_split[:-1])
+        ids, ta, tb = id_split[:-1][same], t_split[:-1][same], t_split[1:][same]
+        dx, dy = x1[ids] - x0[ids], y1[ids] - y0[ids]
+        cells = gridmaker.lattice_cell(x0[ids] + dx*(ta+tb)/2, y0[ids] + dy*(ta+tb)/2, lattice)
+        length = geodesic.segment_length(x0[ids] + dx*ta, y0[ids] + dy*ta, x0[ids] + dx*tb, y0[ids] + dy*tb)/1000 #geodesic length in km
+        located = cells >= 0 #parts outside the grid cells are not measured
+
+        pieces.append(pd.DataFrame({'cell': cells[located], 'asset_index': segment_asset[ids][located], 'length_km': length[located]}))
+
+    pieces = pd.concat(pieces, ignore_index=True) if len(pieces) > 0 else pd.DataFrame({'cell': [], 'asset_index': [], 'length_km': []})
+    pairs = pieces.groupby(['cell', 'asset_index'], as_index=False, sort=False)['length_km'].sum() #one row per asset and grid cell
+    pairs['asset'] = infra_dataset.asset.values[pairs.asset_index.values.astype(np.int64)]
+
+    return pairs.drop(columns=['asset_index'])
+
+def polygons_per_grid(infra_dataset, df_store, lattice, spat_tree=None):
+    """clip polygon assets with the grid cells of a regular lattice. Polygons that are located within a single grid cell are assigned to that grid cell without clipping, only polygons crossing grid boundaries are clipped
+    Arguments:
+        *infra_dataset* : a pd with WGS-84 (multi)polygon coordinates in Pygeos 
+        *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *lattice* : dictionary describing the regular lattice of the grid cells in *df_store* (see gridmaker.grid_lattice)
+        *spat_tree* : spatial tree of the grid cells in *df_store*. Optional, it is created when needed
+        
+    Returns:
+        pd with one row per intersecting grid cell and asset: position of the grid cell in *df_store* (cell), assettype (asset) and (clipped) geometry (geometry)
+    """
+    bounds = pygeos.bounds(infra_dataset.geometry.values)
+    cell_min = gridmaker.lattice_cell(bounds[:,0], bounds[:,3], lattice) #grid cell of upper left corner of the bounding box
+    cell_max = gridmaker.lattice_cell(bounds[:,2], bounds[:,1], lattice) #grid cell of lower right corner of the bounding box
+    contained = (cell_min >= 0) & (cell_min == cell_max)
+
+    pairs_contained = pd.DataFrame({'cell': cell_min[contained],
+                                    'asset': infra_dataset.asset.values[contained],
+                                    'geometry': infra_dataset.geometry.values[contained]})
+    pairs_crossing = grid_asset_pairs(infra_dataset.loc[~contained], df_store, spat_tree) #clip the polygons that cross grid boundaries (or are partly outside the grid)
+
+    return pd.concat([pairs_contained, pairs_crossing], ignore_index=True)
 
-def count_per_grid_pygeos(infra_dataset, df_store):
+def sum_per_grid(pairs, values, n_cells, asset_list):
+    """sum values per grid cell and assettype
+    Arguments:
+        *pairs* : pd with assets per grid cell (see grid_asset_pairs)
+        *values* : array with the value of each row in *pairs* (e.g. 1 for counting)
+        *n_cells* : number of grid cells
+        *asset_list* : list with assettypes
+        
+    Returns:
+        array with the sum per grid cell (rows) and assettype (columns)
+    """
+    codes = pd.Categorical(pairs.asset, categories=asset_list).codes
+    weights = np.broadcast_to(np.asarray(values, dtype=float), len(pairs))
+    table = np.bincount(pairs.cell.values*len(asset_list) + codes, weights=weights, minlength=n_cells*len(asset_list))
+
+    return table.reshape(n_cells, len(asset_list))
+
+def point_pairs(infra_dataset, df_store, spat_tree=None, lattice=None):
+    """assets per grid cell for counting, by arithmetic for point data on a regular lattice and by clipping otherwise
+    Arguments:
+        *infra_dataset* : a pd with WGS-84 coordinates in Pygeos 
+        *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *spat_tree* : spatial tree of the grid cells in *df_store*. Optional, it is created when needed
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice). Optional, it is derived from *df_store* when not given
+        
+    Returns:
+        pd with one row per asset per grid cell: position of the grid cell (cell) and assettype (asset)
+    """
+    if lattice is None: lattice = gridmaker.grid_lattice(df_store)
+    if lattice is not None and (pygeos.get_type_id(infra_dataset.geometry.values) == 0).all(): #regular grid, point data
+        return points_per_grid(infra_dataset, lattice) #get grid cell of each point by arithmetic
+    
+    return grid_asset_pairs(infra_dataset, df_store, spat_tree) #clip infra data for all grid cells at once
+
+def line_pairs(infra_dataset, df_store, spat_tree=None, lattice=None):
+    """length in km of assets per grid cell, by splitting lines at grid boundaries on a regular lattice and by clipping otherwise
+    Arguments:
+        *infra_dataset* : a pd with WGS-84 (multi)linestring coordinates in Pygeos 
+        *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *spat_tree* : spatial tree of the grid cells in *df_store*. Optional, it is created when needed
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice). Optional, it is derived from *df_store* when not given
+        
+    Returns:
+        pd with one row per asset per grid cell: position of the grid cell (cell), assettype (asset) and length in km (length_km)
+    """
+    if lattice is None: lattice = gridmaker.grid_lattice(df_store)
+    if lattice is not None and np.isin(pygeos.get_type_id(infra_dataset.geometry.values), [1, 5]).all(): #regular grid, line data
+        return lines_per_grid(infra_dataset, lattice) #split lines at grid boundaries and measure geodesic length
+    
+    pairs = grid_asset_pairs(infra_dataset, df_store, spat_tree) #clip infra data for all grid cells at once
+    pairs['length_km'] = geodesic.line_length(pairs.geometry.values)/1000 #calculate length per clipped object and transform to km
+    
+    return pairs
+
+def polygon_pairs(infra_dataset, df_store, spat_tree=None, lattice=None):
+    """area in km2 of assets per grid cell, only clipping polygons that cross grid boundaries on a regular lattice
+    Arguments:
+        *infra_dataset* : a pd with WGS-84 (multi)polygon coordinates in Pygeos 
+        *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *spat_tree* : spatial tree of the grid cells in *df_store*. Optional, it is created when needed
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice). Optional, it is derived from *df_store* when not given
+        
+    Returns:
+        pd with one row per asset per grid cell: position of the grid cell (cell), assettype (asset) and area in km2 (area_km2)
+    """
+    if lattice is None: lattice = gridmaker.grid_lattice(df_store)
+    if lattice is not None:
+        pairs = polygons_per_grid(infra_dataset, df_store, lattice, spat_tree) #only clip polygons crossing grid boundaries
+    else:
+        pairs = grid_asset_pairs(infra_dataset, df_store, spat_tree) #clip infra data for all grid cells at once
+    pairs['area_km2'] = geodesic.polygon_area(pairs.geometry.values)/1000000 #calculate area per clipped object and transform to km2
+    
+    return pairs
+
+def base_calculations_per_group(infra_dataset, df_store, spat_tree=None, lattice=None):
+    """count, length and area of the assets of one group per grid in a single pass, for groups with one or multiple datatypes (e.g. point, line, polygon)
+    Arguments:
+        *infra_dataset* : a pd with WGS-84 coordinates in Pygeos 
+        *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *spat_tree* : spatial tree of the grid cells in *df_store*, so it can be reused for all groups. Optional, it is created when needed
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice), so it can be reused for all groups. Optional, it is derived from *df_store* when not given
+        
+    Returns:
+        tuple with an array holding the base calculations (grid cells as rows, same order as *df_store*) and a list with its columns: {asset}_count for all assets, {asset}_km for line assets and {asset}_km2 for polygon assets
+    """
+    if lattice is None: lattice = gridmaker.grid_lattice(df_store)
+    if spat_tree is None: spat_tree = pygeos.STRtree(df_store.geometry) # https://pygeos.readthedocs.io/en/latest/strtree.html
+    
+    geometry_types = pygeos.get_type_id(infra_dataset.geometry.values)
+    datatypes = [(0, [0], point_pairs, None, None), #point data is counted
+                 (5, [1, 5], line_pairs, 'length_km', 'km'), #do not differentiate between linestrings-multilinestrings
+                 (6, [3, 6], polygon_pairs, 'area_km2', 'km2')] #do not differentiate between polygons-multipolygons
+    
+    unexpected = set(np.unique(geometry_types)) - {0, 1, 3, 5, 6}
+    if len(unexpected) > 0:
+        print("WARNING: fetched data contains unexpected geometry types {}, these assets are skipped".format(sorted(unexpected)))
+    
+    #calculate all datatypes first and collect the columns of the group 
+    results = []
+    columns = []
+    for datatype, type_ids, pair_func, value_col, suffix in datatypes:
+        subset = infra_dataset.loc[np.isin(geometry_types, type_ids)]
+        if subset.empty: continue
+        if datatype == 6: 
+            subset = subset.assign(geometry=pygeos.buffer(subset.geometry.values, 0)) #avoid intersection
+        asset_list = list(subset.asset.unique())
+        pairs = pair_func(subset, df_store, spat_tree, lattice)
+        results.append((asset_list, pairs, value_col, suffix))
+        for asset in asset_list:
+            if suffix is not None and not "{}_{}".format(asset, suffix) in columns: columns.append("{}_{}".format(asset, suffix))
+            if not "{}_count".format(asset) in columns: columns.append("{}_count".format(asset))
+    
+    #fill preallocated array with all columns of the group
+    column_index = {col: i for i, col in enumerate(columns)}
+    table = np.zeros((len(df_store), len(columns)), dtype=np.float64)
+    for asset_list, pairs, value_col, suffix in results:
+        count = sum_per_grid(pairs, 1, len(df_store), asset_list) #count number of assets per asset type
+        table[:, [column_index["{}_count".format(asset)] for asset in asset_list]] += count
+        if value_col is not None:
+            value = sum_per_grid(pairs, pairs[value_col], len(df_store), asset_list) #total length or area per asset type
+            table[:, [column_index["{}_{}".format(asset, suffix)] for asset in asset_list]] += value
+    
+    return table, columns
+
+def grid_dataframe(df_store, tables):
+    """combine arrays with base calculations into one dataframe, so a dataframe is only made when results are exported 
+    Arguments:
+        *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *tables* : list with tuples of an array (grid cells as rows) and a list with its column names (see base_calculations_per_group)
+        
+    Returns:
+        df_store with a float column for each column in *tables*, values of columns with the same name are summed
+    """
+    columns = []
+    for table, table_columns in tables:
+        columns.extend([col for col in table_columns if not col in columns])
+
+    column_index = {col: i for i, col in enumerate(columns)}
+    values = np.zeros((len(df_store), len(columns)), dtype=np.float64)
+    for table, table_columns in tables:
+        values[:, [column_index[col] for col in table_columns]] += table
+
+    return pd.concat([pd.DataFrame(values, columns=columns, index=df_store.index), df_store.drop(columns=columns, errors='ignore')], axis=1)
+
+def count_per_grid_pygeos(infra_dataset, df_store, spat_tree=None, lattice=None):
     """count of assets per grid
     Arguments:
         *infra_dataset* : a pd with WGS-84 coordinates in Pygeos 
         *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *spat_tree* : spatial tree of the grid cells in *df_store*. Optional, it is created when needed
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice). Optional, it is derived from *df_store* when not given
         
     Returns:
         Count per assets per grid in dataframe with the following format: column => {asset}_count and row => the grid
@@ -125,27 +486,24 @@ def count_per_grid_pygeos(infra_dataset, df_store):
     asset_list = []
 
     for asset in infra_dataset.asset.unique():
-        if not "{}_count".format(asset) in df_store.columns: df_store.insert(0, "{}_count".format(asset), "") #add assettype as column after first column
+        if not "{}_count".format(asset) in df_store.columns: df_store.insert(0, "{}_count".format(asset), 0.0) #add assettype as column after first column
         asset_list.append(asset)
 
-    spat_tree = pygeos.STRtree(infra_dataset.geometry) # https://pygeos.readthedocs.io/en/latest/strtree.html
-    for grid_cell in tqdm(df_store.itertuples(),total=len(df_store)):
-        asset_clip = clip_pygeos(infra_dataset,grid_cell,spat_tree) #clip infra data using GeoPandas clip
-        count = asset_clip.asset.value_counts() #count number of assets per asset type
+    pairs = point_pairs(infra_dataset, df_store, spat_tree, lattice)
+    count = sum_per_grid(pairs, 1, len(df_store), asset_list) #count number of assets per asset type
 
-        for asset in asset_list:
-            if asset in count.index:
-                df_store.loc[grid_cell.Index, "{}_count".format(asset)] = count.get(key = asset)
-            else:
-                df_store.loc[grid_cell.Index, "{}_count".format(asset)] = 0
+    for i, asset in enumerate(asset_list):
+        df_store["{}_count".format(asset)] = count[:, i]
     
     return df_store
 
-def length_km_per_grid_pygeos(infra_dataset, df_store):
+def length_km_per_grid_pygeos(infra_dataset, df_store, spat_tree=None, lattice=None):
     """Total length in kilometers per assettype per grid (using Pygeos functions to improve speed)
     Arguments:
         *infra_dataset* : a pd with WGS-84 coordinates in Pygeos 
         *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *spat_tree* : spatial tree of the grid cells in *df_store*. Optional, it is created when needed
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice). Optional, it is derived from *df_store* when not given
         
     Returns:
         Length in km per assettype per grid in dataframe with the following format: columns => {asset}_km and rows => the gridcell
@@ -153,49 +511,28 @@ def length_km_per_grid_pygeos(infra_dataset, df_store):
     asset_list = []
 
     for asset in infra_dataset.asset.unique():
-        if not "{}_count".format(asset) in df_store.columns: df_store.insert(0, "{}_count".format(asset), "") #add assettype as column after first column for count calculations
-        if not "{}_km".format(asset) in df_store.columns: df_store.insert(0, "{}_km".format(asset), "") #add assettype as column after first column for length calculations
+        if not "{}_count".format(asset) in df_store.columns: df_store.insert(0, "{}_count".format(asset), 0.0) #add assettype as column after first column for count calculations
+        if not "{}_km".format(asset) in df_store.columns: df_store.insert(0, "{}_km".format(asset), 0.0) #add assettype as column after first column for length calculations
         asset_list.append(asset)
 
-    spat_tree = pygeos.STRtree(infra_dataset.geometry) # https://pygeos.readthedocs.io/en/latest/strtree.html
-    
-    for grid_cell in tqdm(df_store.itertuples(),total=len(df_store)):
-        asset_clip = clip_pygeos(infra_dataset,grid_cell,spat_tree) #clip infra data using GeoPandas clip
-        
-        #count per asset type
-        count = asset_clip.asset.value_counts() #count number of assets per asset type
-        for asset_type in asset_list:
-            if asset_type in count.index:
-                df_store.loc[grid_cell.Index, "{}_count".format(asset_type)] = count.get(key = asset_type)
-            else:
-                df_store.loc[grid_cell.Index, "{}_count".format(asset_type)] = 0
-
-        #calculate length for each asset in clipped infrastructure grid
-        asset_clip.insert(1, "length_km", "") #add assettype as column after first column for length calculations
-        if not asset_clip.empty:
-            geom_series = list(asset_clip.geometry)
-            asset_clip["length_km"]=line_length_pygeos(geom_series)/1000 #calculate length per object, transform to km and put in dataframe
-        
-        length_per_type = asset_clip.groupby(['asset'])['length_km'].sum() #get total length per asset_type in grid
+    pairs = line_pairs(infra_dataset, df_store, spat_tree, lattice)
+    count = sum_per_grid(pairs, 1, len(df_store), asset_list) #count number of assets per asset type
+    length_per_type = sum_per_grid(pairs, pairs.length_km, len(df_store), asset_list) #get total length in km per asset_type in grid
 
-        for asset_type in asset_list:
-            if asset_type in length_per_type.index:
-                df_store.loc[grid_cell.Index, "{}_km".format(asset_type)] = length_per_type.get(key = asset_type)
-            else:
-                df_store.loc[grid_cell.Index, "{}_km".format(asset_type)] = 0  
-                       
-    # print(df_store["{}_km".format(asset_type)])
-    # df_store["{}_km".format(asset_type)] = df_store["{}_km".format(asset_type)].astype(float)
-    # print(df_store["{}_km".format(asset_type)])
+    for i, asset_type in enumerate(asset_list):
+        df_store["{}_count".format(asset_type)] = count[:, i]
+        df_store["{}_km".format(asset_type)] = length_per_type[:, i]
     
     return df_store
 
 
-def area_km2_per_grid_pygeos(infra_dataset, df_store):
+def area_km2_per_grid_pygeos(infra_dataset, df_store, spat_tree=None, lattice=None):
     """Total area in km2 per assettype per grid
     Arguments:
         *infra_dataset* : a pd with WGS-84 coordinates in Pygeos 
         *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each row
+        *spat_tree* : spatial tree of the grid cells in *df_store*. Optional, it is created when needed
+        *lattice* : dictionary describing the regular lattice of the grid cells (see gridmaker.grid_lattice). Optional, it is derived from *df_store* when not given
         
     Returns:
         Area in km2 per assettype per grid in dataframe with the following format: column => {asset}_km2 and row => the gridcell
@@ -203,35 +540,17 @@ def area_km2_per_grid_pygeos(infra_dataset, df_store):
     asset_list = []
 
     for asset in infra_dataset.asset.unique():
-        if not "{}_count".format(asset) in df_store.columns: df_store.insert(0, "{}_count".format(asset), "") #add assettype as column after first column for count calculations
-        if not "{}_km2".format(asset) in df_store.columns: df_store.insert(0, "{}_km2".format(asset), "") #add assettype as column after first column for area calculations
+        if not "{}_count".format(asset) in df_store.columns: df_store.insert(0, "{}_count".format(asset), 0.0) #add assettype as column after first column for count calculations
+        if not "{}_km2".format(asset) in df_store.columns: df_store.insert(0, "{}_km2".format(asset), 0.0) #add assettype as column after first column for area calculations
         asset_list.append(asset)
 
-    spat_tree = pygeos.STRtree(infra_dataset.geometry) # https://pygeos.readthedocs.io/en/latest/strtree.html
-
-    for grid_cell in tqdm(df_store.itertuples(),total=len(df_store)):
-        asset_clip = clip_pygeos(infra_dataset, grid_cell,spat_tree) #clip infra data using GeoPandas clip
+    pairs = polygon_pairs(infra_dataset, df_store, spat_tree, lattice)
+    count = sum_per_grid(pairs, 1, len(df_store), asset_list) #count number of assets per asset type
+    area_per_type = sum_per_grid(pairs, pairs.area_km2, len(df_store), asset_list) #get total area in km2 per asset_type in grid
 
-        #count per asset type
-        count = asset_clip.asset.value_counts() #count number of assets per asset type
-        for asset_type in asset_list:
-            if asset_type in count.index:
-                df_store.loc[grid_cell.Index, "{}_count".format(asset_type)] = count.get(key = asset_type)
-            else:
-                df_store.loc[grid_cell.Index, "{}_count".format(asset_type)] = 0
-
-        #calculate area for each asset in clipped infrastructure grid
-        asset_clip.insert(1, "area_km2", "") #add assettype as column after first column for length calculations
-        if not asset_clip.empty:
-            geom_series = list(asset_clip.geometry)
-            asset_clip["area_km2"] = polygon_area_pygeos(geom_series)/1000000 #calculate area per object and put in dataframe
-
-        area_per_type = asset_clip.groupby(['asset'])['area_km2'].sum() #get total length per asset_type in grid
-        for asset_type in asset_list:
-            if asset_type in area_per_type.index:
-                df_store.loc[grid_cell.Index, "{}_km2".format(asset_type)] = area_per_type.get(key = asset_type)
-            else:
-                df_store.loc[grid_cell.Index, "{}_km2".format(asset_type)] = 0        
+    for i, asset_type in enumerate(asset_list):
+        df_store["{}_count".format(asset_type)] = count[:, i]
+        df_store["{}_km2".format(asset_type)] = area_per_type[:, i]
         
     return df_store
 
@@ -295,23 +614,18 @@ def count_per_grid(infra_dataset, df_store):
 
 def line_length(line, ellipsoid='WGS-84'):
     """Length of a line in kilometers, given in geographic coordinates
-    Adapted from https://gis.stackexchange.com/questions/4022/looking-for-a-pythonic-way-to-calculate-the-length-of-a-wkt-linestring#answer-115285
     Arguments:
         *line* : a shapely LineString object with WGS-84 coordinates
         
     Optional Arguments:
-        *ellipsoid* : string name of an ellipsoid that `geopy` understands (see http://geopy.readthedocs.io/en/latest/#module-geopy.distance)
+        *ellipsoid* : only the WGS-84 ellipsoid is supported (see geodesic.py), other ellipsoids raise a ValueError
         
     Returns:
         Length of line in kilometers
     """
-    if line.geometryType() == 'MultiLineString':
-        return sum(line_length(segment) for segment in line)
-
-    return sum(
-        geodesic(tuple(reversed(a)), tuple(reversed(b)), ellipsoid=ellipsoid).kilometers
-        for a, b in pairwise(line.coords)
-    )
+    if ellipsoid != 'WGS-84':
+        raise ValueError("Ellipsoid '{}' is not supported, lengths are measured on the WGS-84 ellipsoid".format(ellipsoid))
+    return geodesic.line_length([pygeos.from_wkb(line.wkb)])[0]/1000
 
 def length_km_per_grid(infra_dataset, df_store):
     """Total length in kilometers per assettype per grid, given in geographic coordinates
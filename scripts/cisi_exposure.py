@@ -25,6 +25,7 @@ import copy
 #sys.path.append("C:\Projects\Coastal_Infrastructure\scripts")
 import fetch
 import cisi
+import gridmaker
 plt.rcParams['figure.figsize'] = [20, 20]
 
 #from osgeo import gdal
@@ -45,52 +46,26 @@ def base_calculations(infrastructure_systems, fetched_data_dict, grid_data):
     Returns:
         dictionary consisting of a df for each subsystem holding the count, length or area per asset per grid (EPSG:4326 in Pygeos geometry)
     """
-    #use keys in infrastructure_systems to make dataframes for indices https://stackoverflow.com/questions/56217737/use-elements-in-a-list-for-dataframe-names
-    cisi_exposure = {ci_system: grid_data.copy() for ci_system in infrastructure_systems}                 
+    #use keys in infrastructure_systems to collect arrays with base calculations per group (dataframes are made at the end)
+    base_tables = {ci_system: [] for ci_system in infrastructure_systems}                 
     print("The counts, lengths and areas of each asset will now be calculated for each grid cell")
 
+    #spatial tree and lattice of the grid cells are shared by all groups
+    spat_tree = pygeos.STRtree(grid_data.geometry) # https://pygeos.readthedocs.io/en/latest/strtree.html
+    lattice = gridmaker.grid_lattice(grid_data)
+
     #loop through infrastructure systems
     for ci_system in infrastructure_systems:
         print("The loop starts for subsystem {} with assets for the following groups {}".format(ci_system, infrastructure_systems[ci_system]))
         for value in infrastructure_systems[ci_system]:
             if fetched_data_dict[value].empty == False:  
-                #check single datatype or multiple in one df? 
-                list_datatypes = unique_datatypes(fetched_data_dict[value])
-                if len(list_datatypes) == 1:               
-                    # perform base calculations for one datatype
-                    geometry_type = pygeos.geometry.get_type_id(fetched_data_dict[value].iloc[0]["geometry"]) #get geometry id
-                    if geometry_type == 0: #point
-                        #print("{}_{}.gpkg".format(area, value), "has geometrytype", geometry_file)
-                        cisi_exposure[ci_system] = cisi.count_per_grid_pygeos(fetched_data_dict[value], cisi_exposure[ci_system]) 
-                    elif  geometry_type == 1: #"linestring" in geometry_type:
-                        #print("{}_{}.gpkg".format(area, value), "has geometrytype", geometry_file)
-                        cisi_exposure[ci_system] = cisi.length_km_per_grid_pygeos(fetched_data_dict[value], cisi_exposure[ci_system])
-                    elif  geometry_type == 3: #"polygon" in geometry_type:
-                        #print("{}_{}.gpkg".format(area, value), "has geometrytype", geometry_file)
-                        fetched_data_dict[value]['geometry'] =pygeos.buffer(fetched_data_dict[value].geometry,0)
-                        cisi_exposure[ci_system] = cisi.area_km2_per_grid_pygeos(fetched_data_dict[value], cisi_exposure[ci_system])
-                    elif  geometry_type == 5: #"multilinestring" in geometry_type:
-                        #print("{}_{}.gpkg".format(area, value), "has geometrytype", geometry_file)
-                        cisi_exposure[ci_system] = cisi.length_km_per_grid_pygeos(fetched_data_dict[value], cisi_exposure[ci_system])
-                    elif  geometry_type == 6: #"multipolygon" in geometry_type:
-                        #print("{}_{}.gpkg".format(area, value), "has geometrytype", geometry_file)
-                        fetched_data_dict[value]['geometry'] = pygeos.buffer(fetched_data_dict[value].geometry,0)
-                        cisi_exposure[ci_system] = cisi.area_km2_per_grid_pygeos(fetched_data_dict[value], cisi_exposure[ci_system])                        
-                    else: 
-                        print("WARNING: fetched data '{}' contains an unexpected geometry type {}".format(value, geometry_type))
-                elif len(list_datatypes) > 1:
-                        cisi_exposure[ci_system] = base_calculations_multipledatatypes(list_datatypes, fetched_data_dict[value], cisi_exposure[ci_system])
-                else:
-                    print("WARNING: geodataframe contains no data: {}.".format(value))
+                # perform base calculations for all datatypes (point, line, polygon) in one pass
+                base_tables[ci_system].append(cisi.base_calculations_per_group(fetched_data_dict[value], grid_data, spat_tree, lattice))
             else:
                 print("WARNING: the following group does not exist: {}. Empty df is returned".format(value))
 
-        #convert objects to float (to avoid problems with plotting later on)
-        for col in cisi_exposure[ci_system].columns:
-            if "_count" in col or "_km" in col or "_km2" in col:
-                cisi_exposure[ci_system][col] = cisi_exposure[ci_system][col].astype(float)
-            #else:
-            #    print("The following column is not converted into a float: {} ".format(col))
+    #make a df for each subsystem with float columns for the count, length and area of each asset
+    cisi_exposure = {ci_system: cisi.grid_dataframe(grid_data, base_tables[ci_system]) for ci_system in infrastructure_systems}
 
     #temporary lines to get the max values 
     #print("Overview of maxima:")
@@ -101,46 +76,6 @@ def base_calculations(infrastructure_systems, fetched_data_dict, grid_data):
 
     return cisi_exposure
 
-def base_calculations_multipledatatypes(list_datatypes, infra_dataset, df_store):
-    """base calculations for df with multiple datatypes (e.g. point, line, polygon)
-    Arguments:
-        *infra_dataset* : a pd with WGS-84 coordinates in Pygeos 
-        *df_store* : pd containing WGS-84 (in Pygeos) coordinates per grid on each r 
-        
-    Returns:
-        df of a subsystem holding the count, length or area per asset per grid (EPSG:4326 in Pygeos geometry)
-    """
-    import copy 
-    df_final = copy.deepcopy(df_store)
-     
-    #multiple datatypes in one df
-    infra_dataset['datatype'] = pygeos.geometry.get_type_id(infra_dataset["geometry"]) #add column specifying datatype
-    infra_dataset["datatype"].replace({1:5, 3:6}, inplace=True) #do not differentiate between linestrings-multilinestrings, polygons-multipolygons
-    
-    for item in list_datatypes:
-        if item == 0: #point data
-            df_store_point = copy.deepcopy(df_store)
-            point_df = infra_dataset[infra_dataset['datatype'] == 0].drop(['datatype'], axis=1).reset_index(drop=True)
-            grid_point_df = cisi.count_per_grid_pygeos(point_df, df_store_point)
-            df_final = pd.concat([df_final, grid_point_df.drop(['geometry', 'grid_number'], axis=1)], axis=1)
-        elif item == 5: #line data
-            df_store_line = copy.deepcopy(df_store) 
-            line_df = infra_dataset[infra_dataset['datatype'] == 5].drop(['datatype'], axis=1).reset_index(drop=True)
-            grid_line_df = cisi.length_km_per_grid_pygeos(line_df, df_store_line)
-            df_final = pd.concat([df_final, grid_line_df.drop(['geometry', 'grid_number'], axis=1)], axis=1)
-        elif item == 6: #polygon data
-            df_store_polygon = copy.deepcopy(df_store)
-            polygon_df = infra_dataset[infra_dataset['datatype'] == 6].drop(['datatype'], axis=1).reset_index(drop=True)
-            grid_polygon_df = cisi.area_km2_per_grid_pygeos(polygon_df, df_store_polygon)
-            df_final = pd.concat([df_final, grid_polygon_df.drop(['geometry', 'grid_number'], axis=1)], axis=1)
-    
-    #put geometry as last column
-    geo_col = df_final['geometry']
-    df_final = df_final.drop(['geometry'],axis=1)
-    df_final['geometry'] = geo_col
-
-    return df_final
-
 def base_calculations_original(infrastructure_systems, fetched_data_dict, grid_data):
     """ count/length/area of assets per grid in a dictionary containing df's for each subsystem
     Arguments:
@@ -1,14 +1,16 @@
 ################################################################
                 ## Load package and set path ##
 ################################################################
-import os,sys
+import os,sys,time,glob
 import pygeos
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from pathlib import Path
 #from pgpkg import Geopackage
 from geofeather.pygeos import to_geofeather, from_geofeather
 from itertools import repeat
+from functools import partial, lru_cache
 from osgeo import gdal 
 gdal.SetConfigOption("OSM_CONFIG_FILE", os.path.join("..", "osmconf.ini"))
 
@@ -17,6 +19,9 @@ import cisi
 import cisi_exposure
 import extract
 import gridmaker
+import cellstore
+import runstate
+import geodesic
 from multiprocessing import Pool,cpu_count
                 
 #def run_all(goal_area = 'Netherlands', local_path = 'C:/Users/snn490/surfdrive'):
@@ -29,9 +34,9 @@ def run_all(areas, goal_area = 'Global', local_path = os.path.join('/scistor','i
         *local_path* ([str], optional): Local pathway. Defaults to os.path.join('/scistor','ivm','snn490').
     """    
 
-    #extract_infrastructure(local_path)
-    #base_calculations(local_path) 
-    base_calculations_global(local_path) #if base calcs per area already exist
+    extract_infrastructure(local_path) #areas of which the inputs did not change since the previous run are skipped
+    base_calculations(local_path) #areas of which the extracted data did not change since the previous run are imported
+    #base_calculations_global(local_path) #if base calcs per area already exist
     cisi_calculation(local_path,goal_area)
 
 ################################################################
@@ -100,11 +105,109 @@ def set_variables():
     return [infrastructure_systems,weight_assets,weight_groups,weight_subsystems]
 
 
+def set_sharding():
+    """Function to set which areas are split into spatial tiles, so that the extraction and base calculations of very large areas are processed in parallel
+
+    Returns:
+        *tiled_areas* (list): areas (ISO_3digit codes) that are split into tiles
+        *tile_size* (float): size of the tiles in degrees, tiles are aligned with the grid
+    """
+    tiled_areas = [] #e.g. ['USA','RUS','CAN','CHN','BRA','AUS']
+    tile_size = 10 
+
+    return [tiled_areas,tile_size]
+
 ################################################################
                     ## Set pathways ##
 ################################################################
 
-def set_paths(local_path = 'C:/Data/CISI',extract_data=False,base_calculation=False,cisi_calculation=False):
+def set_extraction_rules():
+    """Function to set how the assets of each infrastructure group are extracted from OSM (see extract_group). Per group:
+        *sources* (list): OSM layer, key and values (None for all values) of the features that are extracted, the values of the key become the asset. Or
+        *extract* (function): extraction function of extract.py for groups that combine and filter multiple layers
+        *keep* (list, optional): (lowercase) assets that are kept
+        *mapping* (dictionary, optional): reclassification of the (lowercase) assets
+        *buffer* (bool, optional): True if geometries are buffered by 0 to avoid invalid (self-intersecting) polygons
+
+    Returns:
+        *extraction_rules* (dictionary): infrastructure groups as keys and their rules as values
+    """
+    extraction_rules = {
+        'power': {'extract': extract.merge_energy_datatypes},
+        'roads': {'sources': [('lines', 'highway', None)],
+                  'keep': ["living_street", "motorway", "motorway_link", "primary","primary_link", "residential","road", "secondary", "secondary_link","tertiary","tertiary_link", "trunk", "trunk_link","unclassified","service"],
+                  'mapping': {
+                    "living_street" : "tertiary", 
+                    "motorway" : "primary", 
+                    "motorway_link" : "primary", 
+                    "primary" : "primary", 
+                    "primary_link" : "primary", 
+                    "residential" : "tertiary",
+                    "road" : "secondary", 
+                    "secondary" : "secondary", 
+                    "secondary_link" : "secondary", 
+                    "tertiary" : "tertiary", 
+                    "tertiary_link" : "tertiary", 
+                    "trunk" : "primary",
+                    "trunk_link" : "primary",
+                    "unclassified" : "tertiary", 
+                    "service" : "tertiary"
+                  }},
+        'airports': {'sources': [('multipolygons', 'aeroway', ['aerodrome'])],
+                     'mapping': {"aerodrome" : "airports"},
+                     'buffer': True},
+        'railways': {'sources': [('lines', 'railway', None)],
+                     'keep': ['rail','tram','subway','construction','funicular','light_rail','narrow_gauge'],
+                     'mapping': {
+                        "rail" : "railway",
+                        "tram" : "railway",
+                        "subway" : "railway",
+                        "construction" : "railway",
+                        "funicular" : "railway",
+                        "light_rail" : "railway",
+                        "narrow_gauge" : "railway",
+                        "monorail" : "railway",
+                     }},
+        'ports': {'sources': [('multipolygons', 'landuse', ['industrial','port','harbour'])],
+                  'buffer': True},
+        'water_supply': {'sources': [('multipolygons', 'man_made', ['water_tower','water_well','reservoir_covered','water_works']),
+                                     ('multipolygons', 'landuse', ['reservoir'])],
+                         'buffer': True},
+        'waste_solid': {'sources': [('multipolygons', 'amenity', ['waste_transfer_station']),
+                                    ('multipolygons', 'landuse', ['landfill'])],
+                        'buffer': True},
+        'waste_water': {'sources': [('multipolygons', 'man_made', ['wastewater_plant'])],
+                        'mapping': {"wastewater_plant" : "wastewater_treatment_plant"},
+                        'buffer': True},
+        'telecom': {'extract': extract.telecom,
+                    'mapping': {
+                        "communications_tower" : "communication_tower", #big tower
+                        "tower" : "communication_tower", #small tower
+                        "mast" : "mast"
+                    }},
+        'health': {'extract': extract.social_infrastructure_combined,
+                   'tile_context': {'points': extract.social_infrastructure_polygon}}, #points in health polygons that cross the tile border are needed to remove polygons with overlapping points (see compare_polygon_to_point)
+                   #'mapping': {
+                   #    "doctors" : "doctors",
+                   #    "clinic" : "clinic",
+                   #    "hospital" : "hospital",
+                   #    "dentist" : "dentist",
+                   #    "pharmacy" : "pharmacy",
+                   #    "physiotherapist" : "others",
+                   #    "alternative" : "others",
+                   #    "laboratory" : "others",
+                   #    "optometrist" : "others",
+                   #    "rehabilitation" : "others",
+                   #    "blood_donation" : "others",
+                   #    "birthing_center" : "others"
+                   #}},
+        'education_facilities': {'sources': [('multipolygons', 'amenity', ['college','kindergarten','library','school','university'])],
+                                 'buffer': True},
+    }
+
+    return extraction_rules
+
+def set_paths(local_path = 'C:/Data/CISI',extract_data=False,base_calculation=False,cisi_calculation=False,run_state=False,masks=False):
     """Function to specify required pathways for inputs and outputs
 
     Args:
@@ -112,15 +215,20 @@ def set_paths(local_path = 'C:/Data/CISI',extract_data=False,base_calculation=Fa
         *extract_data* (bool, optional): True if extraction part of model should be activated. Defaults to False.
         *base_calculation* (bool, optional): True if base calculations part of model should be activated. Defaults to False.
         *cisi_calculation* (bool, optional): True if CISI part of model should be activated. Defaults to False.
+        *run_state* (bool, optional): True if directory with run manifests is requested. Defaults to False.
+        *masks* (bool, optional): True if directory with cached masks of areas is requested. Defaults to False.
 
     Returns:
         *osm_data_path* (str): directory to osm data
         *fetched_infra_path* (str): directory to output location of the extracted infrastructure data 
         *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *feature_store_path* (str): directory to output location of the pre-filtered OSM features per area (see ingest_features_per_area)
         *grid_path* (str): directory to feather file of consistent spatial grids
         *infra_base_path* (str): directory to output location of the rasterized infrastructure data 
         *method_max_path* (str): directory to output location of the CISI based on the max of each asset
         *method_mean_path* (str): directory to output location of the CISI based on the mean of the mean of a each asset
+        *run_state_path* (str): directory to manifests with fingerprints of the inputs of each stage per area
+        *mask_path* (str): directory to cached masks of areas (see prepare_country_masks)
     """ 
     # Set path to inputdata
     #osm_data_path = os.path.abspath(os.path.join(local_path,'Datasets','OpenStreetMap')) #path to map with pbf files from OSM 
@@ -140,10 +248,13 @@ def set_paths(local_path = 'C:/Data/CISI',extract_data=False,base_calculation=Fa
 
     # path to save outputs - automatically made, not necessary to change output pathways
     fetched_infra_path = os.path.abspath(os.path.join(base_path,'Fetched_infrastructure')) #path to map with fetched infra-gpkg's 
+    feature_store_path = os.path.abspath(os.path.join(base_path,'Feature_store')) #path to map with pre-filtered OSM features per area
     #fetched_infra_path = os.path.abspath(os.path.join('C:/Users/snn490/Documents','Fetched_infrastructure')) #path to map with fetched infra-gpkg's TEMPORARY
     infra_base_path = os.path.abspath(os.path.join(base_path, 'Infrastructure_base_025')) #save interim calculations
     method_max_path = os.path.abspath(os.path.join(base_path, 'index_025', 'method_max')) #save figures 
     method_mean_path = os.path.abspath(os.path.join(base_path, 'index_025', 'method_mean')) #save figures 
+    run_state_path = os.path.abspath(os.path.join(base_path, 'Run_state')) #save manifests of runs
+    mask_path = os.path.abspath(os.path.join(base_path, 'Masks')) #save masks of areas, used to clip data
     #output_documentation_path = os.path.abspath(os.path.join(base_path, 'index', test_number)) #save documentation
     #output_histogram_path = os.path.abspath(os.path.join(base_path, 'index', test_number)) #save documentation
 
@@ -152,7 +263,8 @@ def set_paths(local_path = 'C:/Data/CISI',extract_data=False,base_calculation=Fa
     Path(fetched_infra_path).mkdir(parents=True, exist_ok=True)
 
     if extract_data:
-        return [osm_data_path,fetched_infra_path,country_shapes_path]
+        Path(feature_store_path).mkdir(parents=True, exist_ok=True)
+        return [osm_data_path,fetched_infra_path,country_shapes_path,feature_store_path]
 
     if base_calculation:
         return [grid_path,fetched_infra_path,infra_base_path,country_shapes_path]
@@ -160,176 +272,475 @@ def set_paths(local_path = 'C:/Data/CISI',extract_data=False,base_calculation=Fa
     if cisi_calculation:
         return [method_max_path,method_mean_path,infra_base_path]
 
+    if run_state:
+        Path(run_state_path).mkdir(parents=True, exist_ok=True)
+        return run_state_path
+
+    if masks:
+        Path(mask_path).mkdir(parents=True, exist_ok=True)
+        return mask_path
+
 ################################################################
  ## Step 1: Extract requested infrastructure from pbf-file  ##
 ################################################################
 
-def extract_infrastructure_per_area(area,groups_list,osm_data_path,fetched_infra_path,country_shapes_path):
+def export_dataframe(df, path, gpkg=True):
+    """function to export a df with pygeos geometries as geopackage and geofeather. Files are written atomically, so an interrupted run does not leave incomplete outputs
+
+    Args:
+        *df*: df with pygeos geometries (EPSG:4326)
+        *path* (str): path to output files without extension
+        *gpkg* (bool, optional): False if only a geofeather is needed (e.g. for interim outputs). Defaults to True.
+    """
+    if gpkg:
+        temp_df = cisi_exposure.transform_to_gpd(gpkg_dtypes(df)) #transform df to gpd with shapely geometries
+        runstate.atomic_write(lambda temp_path: temp_df.to_file(temp_path, layer=' ', driver="GPKG"), path + '.gpkg')
+        #with Geopackage(path + '.gpkg', 'w') as out:
+        #    out.add_layer(df, name=' ', crs='EPSG:4326')
+    runstate.atomic_write(lambda temp_path: to_geofeather(df, temp_path, crs="EPSG:4326"), path + '.feather', sidecars=['.crs']) #save as geofeather
+
+def gpkg_dtypes(df):
+    """function to convert the columns of a df that cannot be written to a geopackage (categorical and nullable integer) to object columns, values are kept
+
+    Args:
+        *df*: df with pygeos geometries
+
+    Returns:
+        *df* with object columns instead of categorical and nullable integer columns
+    """
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) or isinstance(df[col].dtype, pd.Int64Dtype):
+            df[col] = df[col].astype(object).where(df[col].notnull(), None)
+
+    return df
+
+def remove_outputs(path):
+    """function to remove the geopackage and geofeather of a df (e.g. outputs of a previous run that are outdated)
+
+    Args:
+        *path* (str): path to output files without extension
+    """
+    for output_file in [path + '.gpkg', path + '.feather', path + '.feather.crs']:
+        if os.path.isfile(output_file):
+            os.remove(output_file)
+
+def area_tiles(area,grid_data,shape_countries,tile_size):
+    """function to split the grids of an area into spatial tiles (see gridmaker.grid_tiles)
+
+    Args:
+        *area* (str): area to be analyzed
+        *grid_data*: df with grids, its index corresponds to the grid numbers
+        *shape_countries*: df with shapes of countries with ISO_3digit codes
+        *tile_size* (float): size of the tiles in degrees
+
+    Returns:
+        *tiles* (list): per tile a dictionary with the tile number (tile), the grid numbers of the grids in the tile (grid_numbers) and their bounding box (bbox). None if area is not in *shape_countries*
+    """
+    country_shape = shape_countries[shape_countries['ISO_3digit'] == area]
+    if country_shape.empty:
+        print("Area '{}' not specified in file containing shapefiles of countries with ISO_3digit codes. Area will not be split into tiles".format(area))
+        return None
+
+    spat_tree = pygeos.STRtree(grid_data.geometry)
+    grid_data_area = grid_data.iloc[np.sort(spat_tree.query(country_shape.geometry.iloc[0],predicate='intersects'))] #get grids that overlap with area
+    tile_numbers, tile_bounds = gridmaker.grid_tiles(grid_data_area, tile_size)
+
+    return [{'tile': tile, 'grid_numbers': grid_data_area.index.values[tile_numbers == tile], 'bbox': tuple(tile_bounds[tile])} for tile in range(len(tile_bounds))]
+
+def mask_file_path(area,country_shapes_path,mask_path,tile_size=1):
+    """function to obtain the path to the cached mask of an area (see country_mask). The path contains a fingerprint of the dataset with country shapes, so masks are made again when that dataset changes
+
+    Args:
+        *area* (str): area to be analyzed
+        *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *mask_path* (str): directory to cached masks of areas
+        *tile_size* (float, optional): size of the tiles of the mask in degrees. Defaults to 1.
+
+    Returns:
+        *mask_file* (str): path to geofeather with the mask of area
+    """
+    fingerprint = runstate.stage_fingerprint(files=[country_shapes_path], spec=[area, tile_size], code=[gridmaker.subdivide_mask])
+
+    return os.path.join(mask_path, '{}_mask_{}.feather'.format(area, fingerprint[:12]))
+
+def prepare_country_masks(areas,country_shapes_path,mask_path,tile_size=1):
+    """function to make (or refresh) the cached masks of the areas (see country_mask). Runs once before the areas are processed in parallel, so workers only read the masks
+
+    Args:
+        *areas* (list): areas to be analyzed
+        *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *mask_path* (str): directory to cached masks of areas
+        *tile_size* (float, optional): size of the tiles of the mask in degrees. Defaults to 1.
+    """
+    shape_countries = from_geofeather(country_shapes_path) #open as geofeather
+    Path(mask_path).mkdir(parents=True, exist_ok=True)
+    for area in areas:
+        country_shape = shape_countries[shape_countries['ISO_3digit'] == area]
+        mask_file = mask_file_path(area,country_shapes_path,mask_path,tile_size)
+        if country_shape.empty or os.path.isfile(mask_file):
+            continue
+        for old_file in glob.glob(os.path.join(mask_path, '{}_mask_*.feather'.format(area))): #masks of previous versions of the country shapes
+            remove_outputs(old_file[:-len('.feather')])
+        mask = gridmaker.subdivide_mask(country_shape.geometry.iloc[0], tile_size)
+        export_dataframe(mask, mask_file[:-len('.feather')], gpkg=False)
+        print("Mask is made for area '{}'".format(area))
+
+def country_mask(area,shape_countries,country_shapes_path,mask_path,tile_size=1):
+    """function to obtain the polygon of an area split into tiles (see gridmaker.subdivide_mask), so infrastructure can be clipped without intersecting each feature with the whole polygon. 
+    Masks are cached in the output directory of the run by prepare_country_masks, this function only reads them
+
+    Args:
+        *area* (str): area to be analyzed
+        *shape_countries*: df with shapes of countries with ISO_3digit codes
+        *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *mask_path* (str): directory to cached masks of areas
+        *tile_size* (float, optional): size of the tiles of the mask in degrees. Defaults to 1.
+
+    Returns:
+        *mask*: df with the pieces of the polygon of the area. None if area is not in *shape_countries*
+        *geometry*: polygon of the area. None if area is not in *shape_countries*
+    """
+    country_shape = shape_countries[shape_countries['ISO_3digit'] == area]
+    if country_shape.empty:
+        return None,None
+
+    mask_file = mask_file_path(area,country_shapes_path,mask_path,tile_size)
+    if os.path.isfile(mask_file):
+        return from_geofeather(mask_file),country_shape.geometry.iloc[0]
+
+    print("NOTIFICATION: mask of area '{}' is not prepared and will be made without caching".format(area))
+    return gridmaker.subdivide_mask(country_shape.geometry.iloc[0], tile_size),country_shape.geometry.iloc[0]
+
+def extraction_filter(area,shape_countries,tile=None):
+    """function to obtain the spatial filter that is applied when reading the OSM-file of an area, so features outside of the area are not converted
+
+    Args:
+        *area* (str): area to be analyzed
+        *shape_countries*: df with shapes of countries with ISO_3digit codes
+        *tile* (dictionary, optional): tile of area (see area_tiles). Defaults to None (whole area).
+
+    Returns:
+        *spatial_filter*: polygon of area (clipped to the tile), the bounding box of the tile if area is not in *shape_countries* or None if there is no filter
+    """
+    country_shape = shape_countries[shape_countries['ISO_3digit'] == area]
+    if country_shape.empty:
+        return None if tile is None else tile['bbox']
+    if tile is None:
+        return country_shape.geometry.iloc[0]
+
+    return pygeos.intersection(country_shape.geometry.iloc[0], pygeos.box(*tile['bbox']))
+
+def tile_name(area,tile=None):
+    """function to obtain the name under which outputs and manifests of (a tile of) an area are saved
+
+    Args:
+        *area* (str): area to be analyzed
+        *tile* (dictionary, optional): tile of area (see area_tiles). Defaults to None (whole area).
+
+    Returns:
+        *name* (str): e.g. 'USA' or 'USA_tile3'
+    """
+    return area if tile is None else '{}_tile{}'.format(area, tile['tile'])
+
+def feature_store_file(area,feature_store_path,geoType):
+    """function to obtain the path to the pre-filtered OSM features of a layer of an area (see ingest_features_per_area)
+
+    Args:
+        *area* (str): area to be analyzed
+        *feature_store_path* (str): directory to output location of the pre-filtered OSM features per area
+        *geoType* (str): OSM layer, e.g. lines
+
+    Returns:
+        *path* (str): path to feather file
+    """
+    return os.path.join(feature_store_path, '{}_{}.feather'.format(area, geoType))
+
+def ingestion_fingerprint(area,osm_data_path,country_shapes_path):
+    """function to obtain a fingerprint of the inputs of the ingestion of an area (OSM-file, country shapes, keys that are stored and code version)
+
+    Args:
+        *area* (str): area to be analyzed
+        *osm_data_path* (str): directory to osm data
+        *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+
+    Returns:
+        *fingerprint* (str): hash of the inputs
+    """
+    return runstate.stage_fingerprint(files=[os.path.join(osm_data_path, '{}.osm.pbf'.format(area)), country_shapes_path],
+                                      spec=[extract.LAYER_COLUMNS, extract.LAYER_TAGS],
+                                      code=[extract.read_osm_layers, extract.layer_to_dataframe, extract.parse_other_tags, extract.prefilter_layer, ingest_features_per_area])
+
+def ingestion_done(area,osm_data_path,feature_store_path,country_shapes_path,run_state_path):
+    """function to check whether the features of an area are stored with the current inputs (see ingest_features_per_area)
+
+    Args:
+        *area* (str): area to be analyzed
+        *osm_data_path* (str): directory to osm data
+        *feature_store_path* (str): directory to output location of the pre-filtered OSM features per area
+        *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *run_state_path* (str): directory to manifests with fingerprints of the inputs of each stage per area
+
+    Returns:
+        True if ingestion of area can be skipped
+    """
+    fingerprint = ingestion_fingerprint(area,osm_data_path,country_shapes_path)
+    store_files = [feature_store_file(area,feature_store_path,geoType) for geoType in extract.LAYER_COLUMNS]
+
+    return runstate.is_up_to_date(run_state_path, area, 'ingestion', fingerprint) and all(os.path.isfile(path) for path in store_files)
+
+def ingest_features_per_area(area,osm_data_path,feature_store_path,country_shapes_path,run_state_path):
+    """function to read the OSM-file of an area once and store the features that carry at least one of the keys that are used by the infrastructure groups 
+    (extract.LAYER_COLUMNS and the tags in extract.LAYER_TAGS), with their geometry as WKB and the parsed tags as columns. 
+    Extraction reads this store instead of the OSM-file, so changing the extraction rules does not require reading the OSM-file again. 
+    To store features with other keys, add these keys to extract.LAYER_COLUMNS or extract.LAYER_TAGS
+
+    Args:
+        *area* (str): area to be analyzed
+        *osm_data_path* (str): directory to osm data
+        *feature_store_path* (str): directory to output location of the pre-filtered OSM features per area
+        *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *run_state_path* (str): directory to manifests with fingerprints of the inputs of each stage per area
+    """
+    fingerprint = ingestion_fingerprint(area,osm_data_path,country_shapes_path)
+    if ingestion_done(area,osm_data_path,feature_store_path,country_shapes_path,run_state_path):
+        print("Inputs of ingestion did not change for area '{}'. Ingestion will be skipped".format(area))
+        return
+    start_time = time.time()
+
+    #only features intersecting the (buffered) country are stored
+    shape_countries = from_geofeather(country_shapes_path) #open as geofeather
+    osm_layers = extract.read_osm_layers(os.path.join(osm_data_path, '{}.osm.pbf'.format(area)), spatial_filter=extraction_filter(area,shape_countries))
+    for geoType in osm_layers:
+        keys = [a for a in extract.LAYER_COLUMNS[geoType] if a != 'other_tags'] + extract.LAYER_TAGS.get(geoType, [])
+        table = extract.layer_to_table(extract.prefilter_layer(osm_layers[geoType],keys))
+        runstate.atomic_write(lambda temp_path: table.to_feather(temp_path), feature_store_file(area,feature_store_path,geoType))
+    print("OSM features are stored for area '{}'".format(area))
+
+    runstate.record_stage(run_state_path, area, 'ingestion', fingerprint)
+    runstate.record_runtime(run_state_path, area, 'ingestion', time.time() - start_time) #used for scheduling of next run
+
+def load_feature_store(area,feature_store_path,spatial_filter=None):
+    """function to load the pre-filtered OSM features of an area (see ingest_features_per_area)
+
+    Args:
+        *area* (str): area to be analyzed
+        *feature_store_path* (str): directory to output location of the pre-filtered OSM features per area
+        *spatial_filter* (optional): bounding box (xmin, ymin, xmax, ymax) or pygeos geometry. If given, only features intersecting it are loaded. Defaults to None.
+
+    Returns:
+        *osm_layers* (dictionary): OSM layers as keys and df with their features as values, which can be passed to the extraction functions (see extract.read_osm_layers)
+    """
+    osm_layers = {}
+    for geoType in extract.LAYER_COLUMNS:
+        if spatial_filter is None: #whole area, read once
+            osm_layers[geoType] = extract.table_to_layer(pd.read_feather(feature_store_file(area,feature_store_path,geoType))).reset_index(drop=True)
+        else:
+            layer,spat_tree = feature_store_layer(area,feature_store_path,geoType)
+            osm_layers[geoType] = extract.filter_spatially(layer,spatial_filter,spat_tree).reset_index(drop=True)
+
+    return osm_layers
+
+def feature_store_layer(area,feature_store_path,geoType):
+    """function to read a layer of the pre-filtered OSM features of an area with its spatial index, to select the features of tiles (see load_feature_store). 
+    The layer is cached, so the tiles of an area that are extracted by the same worker read the layer and build the spatial index only once
+
+    Args:
+        *area* (str): area to be analyzed
+        *feature_store_path* (str): directory to output location of the pre-filtered OSM features per area
+        *geoType* (str): OSM layer, e.g. lines
+
+    Returns:
+        *layer*: df with the features of the layer. Shared between calls, so it should not be modified
+        *spat_tree*: STRtree of the geometries of *layer*
+    """
+    path = feature_store_file(area,feature_store_path,geoType)
+
+    return read_feature_store_layer(path, os.path.getmtime(path))
+
+@lru_cache(maxsize=len(extract.LAYER_COLUMNS))
+def read_feature_store_layer(path,modified):
+    """function to read a layer of the feature store with its spatial index, cached per file and modification time (see feature_store_layer)
+
+    Args:
+        *path* (str): path to feather file (see feature_store_file)
+        *modified* (float): modification time of the file, so a rewritten file is read again
+
+    Returns:
+        *layer*: df with the features of the layer
+        *spat_tree*: STRtree of the geometries of *layer*
+    """
+    layer = extract.table_to_layer(pd.read_feather(path))
+
+    return layer,pygeos.STRtree(layer.geometry.values)
+
+def tile_context_layers(osm_layers,area,feature_store_path,spatial_filter,context):
+    """function to add features outside of a tile to the OSM layers of the tile, for groups that compare features of different layers (e.g. health points in health polygons). 
+    Without these features, the extraction of a feature crossing the tile border would depend on the tile.
+
+    Args:
+        *osm_layers* (dictionary): OSM layers as keys and df with their features intersecting the tile as values (see load_feature_store)
+        *area* (str): area to be analyzed
+        *feature_store_path* (str): directory to output location of the pre-filtered OSM features per area
+        *spatial_filter*: spatial filter of the tile (see extraction_filter)
+        *context* (dictionary): layers that are extended as keys and a function that selects the features of the tile they are compared with as values, e.g. the health polygons (see set_extraction_rules)
+
+    Returns:
+        *osm_layers* (dictionary): OSM layers, where the features of the layers in *context* intersect the tile or one of the features selected by their context function
+    """
+    if not isinstance(spatial_filter, pygeos.Geometry):
+        spatial_filter = pygeos.box(*spatial_filter)
+
+    osm_layers = dict(osm_layers)
+    for geoType, select_context in context.items():
+        context_data = select_context(osm_layers)
+        if context_data.empty: #no features of the tile are compared with features outside of the tile
+            continue
+        context_filter = np.append(np.array([spatial_filter], dtype=object), context_data.geometry.values)
+        layer,spat_tree = feature_store_layer(area,feature_store_path,geoType)
+        osm_layers[geoType] = extract.filter_spatially(layer,context_filter,spat_tree).reset_index(drop=True)
+
+    return osm_layers
+
+def extract_group(osm_layers,rule):
+    """function to extract the assets of an infrastructure group according to its extraction rule (see set_extraction_rules)
+
+    Args:
+        *osm_layers* (dictionary): OSM layers as keys and df with their features as values (see load_feature_store)
+        *rule* (dictionary): extraction rule of the group
+
+    Returns:
+        *fetched_data*: df with osm_id (integer), asset (lowercase and reclassified, categorical) and geometry of the extracted assets
+    """
+    if 'extract' in rule:
+        fetched_data = rule['extract'](osm_layers) #extract required data
+    else:
+        fetched_data = pd.concat([extract.retrieve_values(osm_layers,geoType,key,values) for geoType,key,values in rule['sources']], ignore_index=True, sort=False)
+        if fetched_data.empty == False:
+            fetched_data = fetched_data[["osm_id","asset","geometry"]]
+
+    if 'asset' in fetched_data.columns:
+        fetched_data = extract.reclassify_assets(fetched_data, rule.get('keep'), rule.get('mapping')) #lowercase, filter and reclassify assets
+        if rule.get('buffer', False):
+            fetched_data['geometry'] = pygeos.buffer(fetched_data.geometry,0) #avoid intersection
+
+    return extract.compact_dtypes(fetched_data)
+
+def extraction_fingerprint(area,groups_list,osm_data_path,country_shapes_path,tile=None):
+    """function to obtain a fingerprint of the inputs of the extraction of an area (OSM-file, country shapes, groups, tile and code version)
+
+    Args:
+        *area* (str): area to be analyzed
+        *groups_list* (list): infrastructure groups that will be extracted
+        *osm_data_path* (str): directory to osm data
+        *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *tile* (dictionary, optional): tile of area (see area_tiles). Defaults to None (whole area).
+
+    Returns:
+        *fingerprint* (str): hash of the inputs
+    """
+    return runstate.stage_fingerprint(files=[os.path.join(osm_data_path, '{}.osm.pbf'.format(area)), country_shapes_path],
+                                      spec=[groups_list, None if tile is None else tile['bbox']],
+                                      code=[extract, cisi.clip_to_mask, set_extraction_rules, extract_group, tile_context_layers, extract_infrastructure_per_area])
+
+def extraction_done(name,fingerprint,groups_list,run_state_path):
+    """function to check whether the extraction of an area (or tile) is finished with the current inputs and its outputs still exist
+
+    Args:
+        *name* (str): name of area or tile (see tile_name)
+        *fingerprint* (str): fingerprint of the current inputs of the extraction (see extraction_fingerprint)
+        *groups_list* (list): infrastructure groups that are extracted
+        *run_state_path* (str): directory to manifests with fingerprints of the inputs of each stage per area
+
+    Returns:
+        True if extraction of *name* can be skipped
+    """
+    return runstate.is_up_to_date(run_state_path, name, 'extraction', fingerprint) and all(runstate.outputs_exist(run_state_path, name, runstate.group_stage('extraction', group)) for group in groups_list)
+
+def extract_infrastructure_per_area(area,groups_list,osm_data_path,fetched_infra_path,feature_store_path,country_shapes_path,run_state_path,mask_path,tile=None):
     """function to extract infrastrastructure for an area 
 
     Args:
         *area* (str): area to be analyzed
         *osm_data_path* (str): directory to osm data
         *fetched_infra_path* (str): directory to output location of the extracted infrastructure data 
+        *feature_store_path* (str): directory to output location of the pre-filtered OSM features per area (see ingest_features_per_area)
         *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *run_state_path* (str): directory to manifests with fingerprints of the inputs of each stage per area
+        *mask_path* (str): directory to cached masks of areas (see prepare_country_masks)
+        *tile* (dictionary, optional): tile of area (see area_tiles). If given, only infrastructure intersecting the tile is extracted and exported as interim output (see merge_tile_extractions). Defaults to None (whole area).
     """
+    #skip extraction if inputs did not change since the previous extraction of area
+    name = tile_name(area, tile) #name of manifest and outputs
+    fingerprint = extraction_fingerprint(area,groups_list,osm_data_path,country_shapes_path,tile)
+    if extraction_done(name,fingerprint,groups_list,run_state_path):
+        print("Inputs of extraction did not change for area '{}'. Extraction will be skipped".format(name))
+        return
+    start_time = time.time()
+    if tile is not None:
+        fetched_infra_path = os.path.join(fetched_infra_path, 'tiles') #interim outputs of tiles
+        Path(fetched_infra_path).mkdir(parents=True, exist_ok=True)
+
     #try:
-    #get shape data
+    #get shape data and the subdivided mask of the area, used to clip the extracted data
     shape_countries = from_geofeather(country_shapes_path) #open as geofeather
+    mask,country_geometry = country_mask(area,shape_countries,country_shapes_path,mask_path)
+
+    extraction_rules = set_extraction_rules()
+    data_found = False #becomes True if infrastructure is found for at least one group
+    print("\033[1mTime to extract infrastructure data for area: {}\033[0m".format(name))
+
+    #load the pre-filtered OSM features of the area (see ingest_features_per_area) for all groups that still need to be extracted, only features intersecting the tile if area is split into tiles
+    group_done = {group: runstate.is_up_to_date(run_state_path, name, runstate.group_stage('extraction', group), fingerprint) and runstate.outputs_exist(run_state_path, name, runstate.group_stage('extraction', group)) for group in groups_list}
+    if not all(group_done.values()):
+        spatial_filter = None if tile is None else extraction_filter(area,shape_countries,tile)
+        osm_layers = load_feature_store(area,feature_store_path,spatial_filter)
 
-    fetched_data_dict = {group: pd.DataFrame() for group in groups_list} #Create dictionary with asset groups as keys and df as value
-    print("\033[1mTime to extract infrastructure data for area: {}\033[0m".format(area))
     for group in groups_list:
+        #skip group if it is already extracted with the same inputs (e.g. in a run that was interrupted)
+        export_path = os.path.join(fetched_infra_path, '{}_{}'.format(name, group))
+        if group_done[group]:
+            print("Group '{}' is already extracted for area '{}'. Extraction will be skipped for this group".format(group, name))
+            data_found = data_found or os.path.isfile(export_path + '.feather')
+            continue
+
         print("Infrastructure belonging to the group '{}' will now be extracted for {}".format(group, area))
-        data = '{}.osm.pbf'.format(area) #make directory to data
-        if group == 'power':
-            fetched_data_area = extract.merge_energy_datatypes(os.path.join(osm_data_path, data)) #extract required data
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase charachters
-        elif group == 'roads':
-            fetched_data_area = extract.roads_all(os.path.join(osm_data_path, data)) #extract required data
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase charachters
-                list_of_highway_assets_to_keep =["living_street", "motorway", "motorway_link", "primary","primary_link", "residential","road", "secondary", "secondary_link","tertiary","tertiary_link", "trunk", "trunk_link","unclassified","service"]
-                fetched_data_area = fetched_data_area.loc[fetched_data_area.asset.isin(list_of_highway_assets_to_keep)].reset_index()
-                #reclassify assets 
-                mapping_dict = {
-                    "living_street" : "tertiary", 
-                    "motorway" : "primary", 
-                    "motorway_link" : "primary", 
-                    "primary" : "primary", 
-                    "primary_link" : "primary", 
-                    "residential" : "tertiary",
-                    "road" : "secondary", 
-                    "secondary" : "secondary", 
-                    "secondary_link" : "secondary", 
-                    "tertiary" : "tertiary", 
-                    "tertiary_link" : "tertiary", 
-                    "trunk" : "primary",
-                    "trunk_link" : "primary",
-                    "unclassified" : "tertiary", 
-                    "service" : "tertiary"
-                }
-                fetched_data_area['asset'] = fetched_data_area.asset.apply(lambda x : mapping_dict[x])  #reclassification
-        elif group == 'airports':
-            fetched_data_area = extract.airports(os.path.join(osm_data_path, data))
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters
-                #reclassify assets 
-                mapping_dict = {
-                    "aerodrome" : "airports",
-                }
-                fetched_data_area['asset'] = fetched_data_area.asset.apply(lambda x : mapping_dict[x])  #reclassification
-                fetched_data_area['geometry'] =pygeos.buffer(fetched_data_area.geometry,0) #avoid intersection
-        elif group == 'railways':
-            fetched_data_area = extract.railway_all(os.path.join(osm_data_path, data))
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters
-                list_of_railway_assets_to_keep =['rail','tram','subway','construction','funicular','light_rail','narrow_gauge']
-                fetched_data_area = fetched_data_area.loc[fetched_data_area.asset.isin(list_of_railway_assets_to_keep)].reset_index()
-                #reclassify assets 
-                mapping_dict = {
-                    "rail" : "railway",
-                    "tram" : "railway",
-                    "subway" : "railway",
-                    "construction" : "railway",
-                    "funicular" : "railway",
-                    "light_rail" : "railway",
-                    "narrow_gauge" : "railway",
-                    "monorail" : "railway",
-                }
-                fetched_data_area['asset'] = fetched_data_area.asset.apply(lambda x : mapping_dict[x])  #reclassification   
-        elif group == 'ports':
-            fetched_data_area  = extract.ports(os.path.join(osm_data_path, data))
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters
-                fetched_data_area['geometry'] =pygeos.buffer(fetched_data_area.geometry,0) #avoid intersection
-        elif group == 'water_supply':
-            fetched_data_area  = extract.water_supply(os.path.join(osm_data_path, data))
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters
-                fetched_data_area['geometry'] =pygeos.buffer(fetched_data_area.geometry,0) #avoid intersection
-        elif group == 'waste_solid':
-            fetched_data_area  = extract.waste_solid(os.path.join(osm_data_path, data))
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters  
-                fetched_data_area['geometry'] =pygeos.buffer(fetched_data_area.geometry,0) #avoid intersection             
-        elif group == 'waste_water':
-            fetched_data_area  = extract.waste_water(os.path.join(osm_data_path, data))
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters
-                #reclassify assets 
-                mapping_dict = {
-                    "wastewater_plant" : "wastewater_treatment_plant"
-                }
-                fetched_data_area['asset'] = fetched_data_area.asset.apply(lambda x : mapping_dict[x])  #reclassification                
-                fetched_data_area['geometry'] =pygeos.buffer(fetched_data_area.geometry,0) #avoid intersection
-        elif group == 'telecom':
-            fetched_data_area  = extract.telecom(os.path.join(osm_data_path, data))
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters
-                #reclassify assets 
-                mapping_dict = {
-                    "communications_tower" : "communication_tower", #big tower
-                    "tower" : "communication_tower", #small tower
-                    "mast" : "mast"
-                }
-                fetched_data_area['asset'] = fetched_data_area.asset.apply(lambda x : mapping_dict[x])  #reclassification
-        elif group == 'health':
-            fetched_data_area  = extract.social_infrastructure_combined(os.path.join(osm_data_path, data))
-            if 'asset' in fetched_data_area.columns:
-                fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters
-                #reclassify assets 
-                #mapping_dict = {
-                #    "doctors" : "doctors",
-                #    "clinic" : "clinic",
-                #    "hospital" : "hospital",
-                #    "dentist" : "dentist",
-                #    "pharmacy" : "pharmacy",
-                #    "physiotherapist" : "others",
-                #    "alternative" : "others",
-                #    "laboratory" : "others",
-                #    "optometrist" : "others",
-                #    "rehabilitation" : "others",
-                #    "blood_donation" : "others",
-                #    "birthing_center" : "others"
-                #}
-                #fetched_data_area['asset'] = fetched_data_area.asset.apply(lambda x : mapping_dict[x])  #reclassification
-        elif group == 'education_facilities':
-                fetched_data_area  = extract.education(os.path.join(osm_data_path, data))
-                if 'asset' in fetched_data_area.columns:
-                    fetched_data_area['asset'] = list(map(lambda x: x.lower(), fetched_data_area['asset'])) #make sure that asset column is in lowercase characters
-                    fetched_data_area['geometry'] =pygeos.buffer(fetched_data_area.geometry,0) #avoid intersection
+        if group in extraction_rules and tile is not None and 'tile_context' in extraction_rules[group]:
+            fetched_data_area = extract_group(tile_context_layers(osm_layers,area,feature_store_path,spatial_filter,extraction_rules[group]['tile_context']),extraction_rules[group])
+        elif group in extraction_rules:
+            fetched_data_area = extract_group(osm_layers,extraction_rules[group])
         else:
             print("WARNING: No extracting codes are written for the following area and group: {} {}".format(area, group))
+            remove_outputs(export_path) #remove outputs of previous runs
+            runstate.record_outputs(run_state_path, name, runstate.group_stage('extraction', group), []) #checkpointed without outputs, so the area is not extracted again in the next run
+            runstate.record_stage(run_state_path, name, runstate.group_stage('extraction', group), fingerprint)
+            continue
 
         #get rid of random floating data
-        country_shape = shape_countries[shape_countries['ISO_3digit'] == area]
-        if country_shape.empty == False: #if ISO_3digit in shape_countries
-            spat_tree = pygeos.STRtree(fetched_data_area.geometry)
-            fetched_data_area = cisi.clip_pygeos(fetched_data_area,country_shape.iloc[0],spat_tree)
+        if mask is not None: #if ISO_3digit in shape_countries
+            fetched_data_area = cisi.clip_to_mask(fetched_data_area,mask,country_geometry)
         else:
             print("ISO_3digit code not specified in file containing shapefiles of country boundaries. Floating data will not be removed for area '{}'".format(area))
             
-        #Save data in df
-        fetched_data_dict[group] = fetched_data_dict[group].append(fetched_data_area, ignore_index=True)
+        #export when df is not empty and checkpoint group
+        if fetched_data_area.empty == False:
+            print("Extraction of requested infrastructure is complete for group '{}' in area '{}'. This data will now be exported as geofeather...".format(group, name))
+            export_dataframe(fetched_data_area, export_path, gpkg=tile is None)
+            output_files = [export_path + '.feather'] + ([export_path + '.gpkg'] if tile is None else [])
+            data_found = True
+        else:
+            print("NOTIFICATION: Extraction for group '{}' for area '{}' resulted in an empty df. No output will be made...".format(group, name)) 
+            remove_outputs(export_path) #remove outputs of previous runs
+            output_files = []
+        runstate.record_outputs(run_state_path, name, runstate.group_stage('extraction', group), output_files)
+        runstate.record_stage(run_state_path, name, runstate.group_stage('extraction', group), fingerprint)
         
-    #if all df's are empty for area, then warning. Otherwise, make outputs
-    if cisi.check_dfs_empty(fetched_data_dict) == False: #df's contain data
-        for group in groups_list:
-            #export when df is not empty 
-            if fetched_data_dict[group].empty == False:
-                print("Extraction of requested infrastructure is complete for group '{}' in area '{}'. This data will now be exported as geofeather...".format(group, area))
-                #Export fetched exposure data as geopackage
-                temp_df = cisi_exposure.transform_to_gpd(fetched_data_dict[group])
-                temp_df.to_file(os.path.join(fetched_infra_path, '{}_{}.gpkg'.format(area,group)), layer=' ', driver="GPKG")
-                #with Geopackage(os.path.join(fetched_infra_path, '{}_{}.gpkg'.format(area,group)), 'w') as out:
-                #    out.add_layer(fetched_data_dict[group], name=' ', crs='EPSG:4326')
-                to_geofeather(fetched_data_dict[group], os.path.join(fetched_infra_path, '{}_{}.feather'.format(area, group)), crs="EPSG:4326") #save as geofeather
-            else:
-                print("NOTIFICATION: Extraction for group '{}' for area '{}' resulted in an empty df. No output will be made...".format(group, area)) 
-    else:
-        print("WARNING: No infrastructure data is found in area '{}'. Please check if OSM-file is correct and whether it intersects with polygon of area (country_shape)".format(area))
+    #if all df's are empty for area, then warning
+    if data_found == False:
+        print("WARNING: No infrastructure data is found in area '{}'. Please check if OSM-file is correct and whether it intersects with polygon of area (country_shape)".format(name))
+
+    runstate.record_stage(run_state_path, name, 'extraction', fingerprint)
+    runstate.record_runtime(run_state_path, name, 'extraction', time.time() - start_time) #used for scheduling of next run
 
     #except Exception as e:
     #    print('ERROR: {} for {}'.format(e, area))
@@ -351,6 +762,49 @@ def group_infrastructure_assets(infrastructure_systems):
 
     return groups_list
 
+def merge_tile_extractions(area,tiles,groups_list,fetched_infra_path,run_state_path):
+    """function to merge the extracted infrastructure of the tiles of an area. Infrastructure crossing tile borders is extracted for each tile it intersects (with the same result, see tile_context_layers), these duplicates are removed
+
+    Args:
+        *area* (str): area to be analyzed
+        *tiles* (list): tiles of area (see area_tiles)
+        *groups_list* (list): infrastructure groups that are extracted
+        *fetched_infra_path* (str): directory to output location of the extracted infrastructure data 
+        *run_state_path* (str): directory to manifests with fingerprints of the inputs of each stage per area
+    """
+    tile_paths = {group: [os.path.join(fetched_infra_path, 'tiles', '{}_{}.feather'.format(tile_name(area, tile), group)) for tile in tiles] for group in groups_list}
+    fingerprint = runstate.stage_fingerprint(files=[path for group in groups_list for path in tile_paths[group]], spec=groups_list, code=[merge_tile_extractions])
+    if extraction_done(area,fingerprint,groups_list,run_state_path):
+        print("Extracted tiles did not change for area '{}'. Merge will be skipped".format(area))
+        return
+
+    for group in groups_list:
+        tile_data = [from_geofeather(path) for path in tile_paths[group] if os.path.isfile(path)]
+        export_path = os.path.join(fetched_infra_path, '{}_{}'.format(area, group))
+        if len(tile_data) == 0:
+            remove_outputs(export_path) #remove outputs of previous runs
+            runstate.record_outputs(run_state_path, area, runstate.group_stage('extraction', group), [])
+            continue
+        fetched_data_area = pd.concat(tile_data, ignore_index=True)
+        duplicate = pd.DataFrame({'osm_id': fetched_data_area['osm_id'].values, 
+                                  'asset': fetched_data_area['asset'].values,
+                                  'wkb': pygeos.to_wkb(fetched_data_area.geometry.values)}).duplicated() #same feature extracted for multiple tiles
+        export_dataframe(extract.compact_dtypes(fetched_data_area.loc[~duplicate.values]), export_path) #categories of tiles may differ
+        runstate.record_outputs(run_state_path, area, runstate.group_stage('extraction', group), [export_path + '.feather', export_path + '.gpkg'])
+    print("Extracted infrastructure of {} tiles is merged for area '{}'".format(len(tiles), area))
+    runstate.record_stage(run_state_path, area, 'extraction', fingerprint)
+
+def file_size(path):
+    """function to obtain the size of a file, used as estimate of the workload of an area
+
+    Args:
+        *path* (str): path to file
+
+    Returns:
+        *size* (int): size of file in bytes, 0 if file does not exist
+    """
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
 def extract_infrastructure(local_path):
     """function to extract infrastructure per area, parallel processing 
 
@@ -358,7 +812,7 @@ def extract_infrastructure(local_path):
         *local_path*: Local pathway. Defaults to os.path.join('/scistor','ivm','snn490').
     """
     # get paths
-    osm_data_path,fetched_infra_path,country_shapes_path = set_paths(local_path,extract_data=True)
+    osm_data_path,fetched_infra_path,country_shapes_path,feature_store_path = set_paths(local_path,extract_data=True)
 
     # get settings
     infrastructure_systems = set_variables()[0]
@@ -369,32 +823,173 @@ def extract_infrastructure(local_path):
     # turn dict into list to make sure we have all unique areas
     #listed_areas = list(areas.values())[0]
 
-    # run the extract parallel per area
-    print('Time to start extraction of requested assets for the following areas: {}'.format(areas))
+    # split very large areas into tiles that are extracted in parallel
+    tiles_per_area = split_areas(local_path)
+
+    # schedule the areas (or tiles) with the longest (expected) extraction first, based on runtimes of previous runs or the size of the OSM-file. Areas that are up to date are scheduled last
+    run_state_path = set_paths(local_path,run_state=True)
+    sizes = {area: file_size(os.path.join(osm_data_path, '{}.osm.pbf'.format(area))) for area in areas}
+    tasks = [(area, tile) for area in areas for tile in tiles_per_area.get(area, [None])]
+    pending = [tile_name(area, tile) for area, tile in tasks if not extraction_done(tile_name(area, tile),extraction_fingerprint(area,groups_list,osm_data_path,country_shapes_path,tile),groups_list,run_state_path)]
+    tasks = schedule_tasks(tasks, tiles_per_area, run_state_path, 'extraction', sizes, pending)
+    scheduled_areas = [tile_name(area, tile) for area, tile in tasks]
+
+    # read the OSM-files parallel per area and store the relevant features (only for areas of which the OSM-file changed)
+    pending = [area for area in areas if not ingestion_done(area,osm_data_path,feature_store_path,country_shapes_path,run_state_path)]
+    ingestion_order = runstate.largest_first(areas, run_state_path, 'ingestion', sizes, pending)
+    with Pool(cpu_count()-1) as pool: 
+        pool.starmap(ingest_features_per_area,[(area,osm_data_path,feature_store_path,country_shapes_path,run_state_path) for area in ingestion_order],
+                                                        chunksize=1) 
+
+    # make the masks that are used to clip the extracted data, before the workers start
+    mask_path = set_paths(local_path,masks=True)
+    prepare_country_masks(areas,country_shapes_path,mask_path)
+
+    # run the extract parallel per area (or tile)
+    print('Time to start extraction of requested assets for the following areas: {}'.format(scheduled_areas))
     with Pool(cpu_count()-1) as pool: 
-        pool.starmap(extract_infrastructure_per_area,zip(areas,
-                                                        repeat(groups_list,len(areas)),
-                                                        repeat(osm_data_path,len(areas)),
-                                                        repeat(fetched_infra_path,len(areas)),
-                                                        repeat(country_shapes_path,len(areas))),
+        pool.starmap(extract_infrastructure_per_area,[(area,groups_list,osm_data_path,fetched_infra_path,feature_store_path,country_shapes_path,run_state_path,mask_path,tile) for area, tile in tasks],
                                                         chunksize=1) 
+
+    # merge the tiles of areas that are split into tiles
+    for area in tiles_per_area:
+        merge_tile_extractions(area,tiles_per_area[area],groups_list,fetched_infra_path,run_state_path)
+
+def schedule_tasks(tasks,tiles_per_area,run_state_path,stage,sizes,pending):
+    """function to order the areas and tiles of areas by expected runtime of a stage, longest first (see runstate.largest_first). Tiles are scheduled by their own recorded runtimes
+
+    Args:
+        *tasks* (list): tuples with area and tile (None if area is not split into tiles)
+        *tiles_per_area* (dictionary): areas that are split as keys and their tiles as values (see split_areas)
+        *run_state_path* (str): directory to manifests with fingerprints of the inputs of each stage per area
+        *stage* (str): name of stage (e.g. 'extraction')
+        *sizes* (dictionary): areas as keys and the size of their inputs as values, the size of a tile is estimated as an equal share of its area
+        *pending* (list): names of the areas and tiles (see tile_name) for which the stage has to run
+
+    Returns:
+        *tasks* (list): *tasks* ordered by expected runtime
+    """
+    names = {tile_name(area, tile): (area, tile) for area, tile in tasks}
+    task_sizes = {name: sizes[area] / len(tiles_per_area.get(area, [None])) for name, (area, tile) in names.items()}
+
+    return [names[name] for name in runstate.largest_first(list(names), run_state_path, stage, task_sizes, pending)]
+
+def split_areas(local_path,grid_data=None):
+    """function to split the areas that are specified in set_sharding into spatial tiles
+
+    Args:
+        *local_path*: Local pathway. Defaults to os.path.join('/scistor','ivm','snn490').
+        *grid_data* (optional): df with grids, if already loaded. Defaults to None (grids are imported).
+
+    Returns:
+        *tiles_per_area* (dictionary): areas that are split as keys and their tiles as values (see area_tiles)
+    """
+    tiled_areas,tile_size = set_sharding()
+    tiled_areas = [area for area in areas if area in tiled_areas]
+    if len(tiled_areas) == 0:
+        return {}
+
+    grid_path,country_shapes_path = set_paths(local_path,base_calculation=True)[0],set_paths(local_path,base_calculation=True)[3]
+    if grid_data is None: grid_data = from_geofeather(grid_path) #open as geofeather
+    shape_countries = from_geofeather(country_shapes_path) #open as geofeather
+    tiles_per_area = {}
+    for area in tiled_areas:
+        tiles = area_tiles(area,grid_data,shape_countries,tile_size)
+        if tiles is not None:
+            tiles_per_area[area] = tiles
+            print("Area '{}' is split into {} tiles".format(area, len(tiles)))
+
+    return tiles_per_area
     
 
 ################################################################
       ## Step 2: Perform base calculations per area ##
 ################################################################
 
-def base_calculation_per_area(area,infrastructure_systems,local_path):
+def base_calculation_fingerprint(area,infrastructure_systems,grid_path,fetched_infra_path,country_shapes_path,tile=None):
+    """function to obtain a fingerprint of the inputs of the base calculations of an area (extracted data, grid, country shapes, sub-systems, tile and code version)
+
+    Args:
+        *area* (str): area to be analyzed
+        *infrastructure_systems* (dictionary): overview of overarching infrastructure sub-systems as keys and a list with the associated sub-systems as values
+        *grid_path* (str): directory to feather file of consistent spatial grids
+        *fetched_infra_path* (str): directory to output location of the extracted infrastructure data 
+        *country_shapes_path* (str): directory to dataset with administrative boundaries (e.g. of countries)
+        *tile* (dictionary, optional): tile of area (see area_tiles). Defaults to None (whole area).
+
+    Returns:
+        *fingerprint* (str): hash of the inputs
+    """
+    fetched_files = [os.path.join(fetched_infra_path, '{}_{}.feather'.format(area, group)) for group in group_infrastructure_assets(infrastructure_systems)]
+
+    return runstate.stage_fingerprint(files=fetched_files + [grid_path, country_shapes_path],
+                                      spec=[infrastructure_systems, None if tile is None else tile['bbox']],
+                                      code=[cisi, cisi_exposure, gridmaker, geodesic, cellstore, base_calculation_per_area])
+
+def base_calculation_files(area,infrastructure_systems,infra_base_path,tile=None):
+    """function to obtain the paths to the sparse stores with base calculations of an area (or tile) per sub-system
+
+    Args:
+        *area* (str): area to be analyzed
+        *infrastructure_systems* (dictionary): overview of overarching infrastructure sub-systems as keys and a list with the associated sub-systems as values
+        *infra_base_path* (str): directory to output location of the rasterized infrastructure data 
+        *tile* (dictionary, optional): tile of area (see area_tiles). Defaults to None (whole area).
+
+    Returns:
+        *cells_files* (dictionary): sub-systems as keys and paths to feather files as values
+    """
+    base_per_area_path = os.path.join(infra_base_path, "base_per_area") if tile is None else os.path.join(infra_base_path, "base_per_area", "tiles")
+
+    return {ci_system: os.path.join(base_per_area_path, '{}_{}_cells.feather'.format(tile_name(area, tile), ci_system)) for ci_system in infrastructure_systems}
+
+def base_calculation_done(area,infrastructure_systems,local_path,tile=None):
+    """function to check whether the base calculations of an area (or tile) are finished for all sub-systems with the current inputs
+
+    Args:
+        *area* (str): area to be analyzed
+        *infrastructure_systems* (dictionary): overview of overarching infrastructure sub-systems as keys and a list with the associated sub-systems as values
+        *local_path*: Local pathway. Defaults to os.path.join('/scistor','ivm','snn490').
+        *tile* (dictionary, optional): tile of area (see area_tiles). Defaults to None (whole area).
+
+    Returns:
+        True if the base calculations of area (or tile) can be imported from a previous run
+    """
+    grid_path,fetched_infra_path,infra_base_path,country_shapes_path = set_paths(local_path,base_calculation=True)
+    run_state_path = set_paths(local_path,run_state=True)
+    fingerprint = base_calculation_fingerprint(area,infrastructure_systems,grid_path,fetched_infra_path,country_shapes_path,tile)
+    cells_files = base_calculation_files(area,infrastructure_systems,infra_base_path,tile)
+
+    return all(runstate.is_up_to_date(run_state_path, tile_name(area, tile), runstate.group_stage('base_calculation', ci_system), fingerprint) and os.path.isfile(cells_files[ci_system]) for ci_system in infrastructure_systems)
+
+def base_calculation_per_area(area,infrastructure_systems,local_path,tile=None):
     """calculate the amount of infrastructure per defined area
     Args:
         *area* : area to be analyzed
         *infrastructure_systems* : dictionairy containing the subsystems as keys and subgroups as values 
         *local_path*: Local pathway. Defaults to os.path.join('/scistor','ivm','snn490'). 
+        *tile* : tile of area (see area_tiles). If given, only the grids of the tile are analyzed and outputs are saved as interim outputs (see merge_tile_base_calculations). Optional, defaults to None (whole area)
     """
     #try:
     # get paths
     grid_path,fetched_infra_path,infra_base_path,country_shapes_path= set_paths(local_path,base_calculation=True)
 
+    run_state_path = set_paths(local_path,run_state=True)
+    base_per_area_path = os.path.join(infra_base_path, "base_per_area") if tile is None else os.path.join(infra_base_path, "base_per_area", "tiles")
+    name = tile_name(area, tile) #name of manifest and outputs
+
+    #import base calculations of sub-systems that are finished with the same inputs (e.g. in a previous run or a run that was interrupted)
+    fingerprint = base_calculation_fingerprint(area,infrastructure_systems,grid_path,fetched_infra_path,country_shapes_path,tile)
+    cells_files = base_calculation_files(area,infrastructure_systems,infra_base_path,tile)
+    cells_base_area = {ci_system: cellstore.load_cellstore(cells_files[ci_system]) for ci_system in infrastructure_systems 
+                       if runstate.is_up_to_date(run_state_path, name, runstate.group_stage('base_calculation', ci_system), fingerprint) and os.path.isfile(cells_files[ci_system])}
+    if len(cells_base_area) == len(infrastructure_systems):
+        print("Inputs of base calculations did not change for area '{}'. Base calculations of previous run will be imported".format(name))
+        return name,cells_base_area
+    elif len(cells_base_area) > 0:
+        print("Base calculations are already finished for the following sub-systems in area '{}': {}. These will be imported".format(name, list(cells_base_area)))
+    infrastructure_systems = {ci_system: infrastructure_systems[ci_system] for ci_system in infrastructure_systems if ci_system not in cells_base_area} #remaining sub-systems
+    start_time = time.time()
+
     # get grid data
     grid_data = from_geofeather(grid_path) #open as geofeather
 
@@ -422,20 +1017,25 @@ def base_calculation_per_area(area,infrastructure_systems,local_path):
     #else: #otherwise, start base calculations
 
     fetched_data_dict = {group: pd.DataFrame() for group in groups_list} #Create dictionary with asset groups as keys and df as value
-    print("Time to import the fetched data files and put it in a dictionairy for base calculations for area: {}".format(area))
+    print("Time to import the fetched data files and put it in a dictionairy for base calculations for area: {}".format(name))
 
     #get fetched_data_dict for area
     for group in groups_list:
         if os.path.isfile(os.path.join(fetched_infra_path, '{}_{}.feather'.format(area, group))) == True:
             fetched_data_dict[group] = from_geofeather(os.path.join(fetched_infra_path, '{}_{}.feather'.format(area,group))) #open as geofeather                
+            if tile is not None: #only keep infrastructure that intersects the tile
+                fetched_data_dict[group] = fetched_data_dict[group].iloc[np.sort(pygeos.STRtree(fetched_data_dict[group].geometry).query(pygeos.box(*tile['bbox']),predicate='intersects'))].reset_index(drop=True)
     
-    Path(os.path.join(infra_base_path, "base_per_area")).mkdir(parents=True, exist_ok=True) #create pathway
+    Path(base_per_area_path).mkdir(parents=True, exist_ok=True) #create pathway
     if cisi.check_dfs_empty(fetched_data_dict) == False: #df's contain data
         shape_countries = from_geofeather(country_shapes_path) #open as geofeather
-        country_shape = shape_countries[shape_countries['ISO_3digit'] == area]
-        if country_shape.empty == False: #if ISO_3digit in shape_countries
+        mask = country_mask(area,shape_countries,country_shapes_path,set_paths(local_path,masks=True))[0]
+        if tile is not None: #grids of tile
+            grid_data_area = grid_data.loc[tile['grid_numbers']].sort_index(ascending=True)
+            grid_data_area = grid_data_area.reset_index().rename(columns = {'index':'grid_number'}) #get index as column and name column grid_number
+        elif mask is not None: #if ISO_3digit in shape_countries
             spat_tree = pygeos.STRtree(grid_data.geometry)
-            grid_data_area = (grid_data.loc[spat_tree.query(country_shape.geometry.iloc[0],predicate='intersects').tolist()]).sort_index(ascending=True) #get grids that overlap with cover_box
+            grid_data_area = grid_data.iloc[cisi.mask_query(mask,spat_tree)].sort_index(ascending=True) #get grids that overlap with area
             grid_data_area = grid_data_area.reset_index().rename(columns = {'index':'grid_number'}) #get index as column and name column grid_number
         else:
             print("Area '{}' not specified in file containing shapefiles of countries with ISO_3digit codes. Grid file will be clipped based on an overlay with infrastructure data".format(area))
@@ -448,27 +1048,98 @@ def base_calculation_per_area(area,infrastructure_systems,local_path):
         #start base calculations
         cisi_exposure_base_area = cisi_exposure.base_calculations(infrastructure_systems, fetched_data_dict, grid_data_area)
 
-        #and save base calculations per area as geofeather
+        #and save base calculations per area as geofeather, and as sparse store (only occupied grid cells) for the summary base calculations. Each sub-system is checkpointed
         for ci_system in cisi_exposure_base_area:
             if cisi_exposure_base_area[ci_system].empty == False:
-                temp_df = cisi_exposure.transform_to_gpd((cisi_exposure_base_area[ci_system])) #transform df to gpd with shapely geometries
-                temp_df.to_file(os.path.join(infra_base_path, "base_per_area", '{}_{}.gpkg'.format(area, ci_system)), layer=' ', driver="GPKG")
-                to_geofeather(cisi_exposure_base_area[ci_system], os.path.join(infra_base_path, "base_per_area", '{}_{}.feather'.format(area, ci_system)), crs="EPSG:4326") #save as geofeather
-                #with Geopackage(os.path.join(infra_base_path, "base_per_area", '{}_{}.gpkg'.format(area, ci_system)), 'w') as out:
-                #    out.add_layer(cisi_exposure_base_area[ci_system], name=' ', crs='EPSG:4326')
-                cisi_exposure_base_area[ci_system].geometry = pygeos.to_wkb(cisi_exposure_base_area[ci_system].geometry)
-        print("Base calculations are finished and data is exported for area: {}".format(area))
-
-        return area,cisi_exposure_base_area
+                export_dataframe(cisi_exposure_base_area[ci_system], os.path.join(base_per_area_path, '{}_{}'.format(name, ci_system)), gpkg=tile is None)
+            cells_base_area[ci_system] = cellstore.to_cellstore(cisi_exposure_base_area[ci_system])
+            runstate.atomic_write(lambda temp_path: cellstore.save_cellstore(cells_base_area[ci_system], temp_path), cells_files[ci_system])
+            runstate.record_stage(run_state_path, name, runstate.group_stage('base_calculation', ci_system), fingerprint)
+        print("Base calculations are finished and data is exported for area: {}".format(name))
     else:
-        print("WARNING: there is no infrastructure extracted for area '{}'. Please check if OSM-file is correct and matches polygon of area (country_shape)".format(area))
-        cisi_exposure_base_area = {ci_system: pd.DataFrame() for ci_system in infrastructure_systems} #create empty dictionary 
+        print("WARNING: there is no infrastructure extracted for area '{}'. Please check if OSM-file is correct and matches polygon of area (country_shape)".format(name))
+        for ci_system in infrastructure_systems: 
+            cells_base_area[ci_system] = cellstore.empty_cellstore()
+            remove_outputs(os.path.join(base_per_area_path, '{}_{}'.format(name, ci_system))) #remove outputs of previous runs
+            runstate.atomic_write(lambda temp_path: cellstore.save_cellstore(cells_base_area[ci_system], temp_path), cells_files[ci_system])
+            runstate.record_stage(run_state_path, name, runstate.group_stage('base_calculation', ci_system), fingerprint)
+    runstate.record_stage(run_state_path, name, 'base_calculation', fingerprint)
+    runstate.record_runtime(run_state_path, name, 'base_calculation', time.time() - start_time) #used for scheduling of next run
         
-        return area,cisi_exposure_base_area
+    return name,cells_base_area
     
     #except Exception as e:
     #    print('TEMPORARY EXCEPTION ERROR: {} for {}'.format(e, area))
 
+def base_calculation_per_task(task,infrastructure_systems,local_path):
+    """calculate the amount of infrastructure per area or tile of an area, so both can be scheduled in the same worker pool
+    Args:
+        *task* : tuple with the area to be analyzed and its tile (None if area is not split into tiles)
+        *infrastructure_systems* : dictionairy containing the subsystems as keys and subgroups as values 
+        *local_path*: Local pathway. Defaults to os.path.join('/scistor','ivm','snn490'). 
+
+    Returns:
+        tuple with area, tile and dictionary with sparse store per sub-system (see base_calculation_per_area)
+    """
+    area,tile = task
+    cells_base_area = base_calculation_per_area(area,infrastructure_systems,local_path,tile)[1]
+
+    return area,tile,cells_base_area
+
+def merge_tile_base_calculations(area,tiles,infrastructure_systems,infra_base_path):
+    """function to merge the base calculations of the tiles of an area into the base calculations of the area. Tiles consist of different grids, so outputs are concatenated
+
+    Args:
+        *area* (str): area to be analyzed
+        *tiles* (list): tiles of area (see area_tiles)
+        *infrastructure_systems* (dictionary): overview of overarching infrastructure sub-systems as keys and a list with the associated sub-systems as values
+        *infra_base_path* (str): directory to output location of the rasterized infrastructure data 
+    """
+    tiles_path = os.path.join(infra_base_path, "base_per_area", "tiles")
+    for ci_system in infrastructure_systems:
+        export_path = os.path.join(infra_base_path, "base_per_area", '{}_{}'.format(area, ci_system))
+        tile_files = [os.path.join(tiles_path, '{}_{}'.format(tile_name(area, tile), ci_system)) for tile in tiles]
+        stores = [cellstore.load_cellstore(path + '_cells.feather') for path in tile_files if os.path.isfile(path + '_cells.feather')]
+        runstate.atomic_write(lambda temp_path: cellstore.save_cellstore(cellstore.sum_cellstores(stores), temp_path), export_path + '_cells.feather')
+
+        tile_data = [from_geofeather(path + '.feather') for path in tile_files if os.path.isfile(path + '.feather')]
+        if len(tile_data) > 0:
+            export_dataframe(pd.concat(tile_data, ignore_index=True).sort_values('grid_number').reset_index(drop=True), export_path)
+        else:
+            remove_outputs(export_path) #remove outputs of previous runs
+    print("Base calculations of {} tiles are merged for area '{}'".format(len(tiles), area))
+
+def assets_per_system(weight_assets):
+    """function to obtain a list of the assets per infrastructure sub-system that are used for the CISI
+
+    Args:
+        *weight_assets* (dictionary): overview of the weighting of the assets per overarching infrastructure sub-system
+
+    Returns:
+        *asset_dict* (dictionary): overview of overarching infrastructure sub-systems as keys and a list with the associated assets as values
+    """
+    asset_dict = {}
+    for ci_system in weight_assets:
+        asset_dict[ci_system] = []
+        for group in weight_assets[ci_system]:
+            for asset in weight_assets[ci_system][group]:
+                asset_dict[ci_system].append(asset)
+
+    return asset_dict
+
+def export_summary_base_calculations(table, ci_system, grid_data, asset_list, infra_base_path):
+    """function to export the summary base calculations of a sub-system, as sparse store and as (dense) geofeather and geopackage
+
+    Args:
+        *table*: array with summed base calculations, a row per grid in *grid_data* and a column per asset in *asset_list* (see cellstore.py)
+        *ci_system* (str): infrastructure sub-system
+        *grid_data*: df with grids, its index corresponds to the grid numbers
+        *asset_list* (list): assets of *ci_system*, the columns of *table*
+        *infra_base_path* (str): directory to output location of the rasterized infrastructure data 
+    """
+    runstate.atomic_write(lambda temp_path: cellstore.save_cellstore(cellstore.from_table(grid_data.index.values, table, asset_list), temp_path), os.path.join(infra_base_path, 'summary_basecalcs_{}_cells.feather'.format(ci_system)))
+    export_dataframe(cellstore.table_to_dataframe(table, grid_data, asset_list), os.path.join(infra_base_path, 'summary_basecalcs_{}'.format(ci_system)))
+
 def base_calculations(local_path):
     """function to calculate the amount of infrastructure per area (e.g. per country) using parallel processing 
     Args:
@@ -477,64 +1148,55 @@ def base_calculations(local_path):
 
     # get settings
     infrastructure_systems,weight_assets = set_variables()[0:2]
-
-    # run the base calculation parallel per area
-    #listed_areas = list(areas.values())[0]
-    print('Time to start base calcualations for the following areas: {}'.format(areas))
-    with Pool(cpu_count()-1) as pool: 
-        cisi_exposure_per_area = dict(pool.starmap(base_calculation_per_area,zip(areas,
-                                                        repeat(infrastructure_systems,len(areas)),
-                                                        repeat(local_path,len(areas))),
-                                                        chunksize=1))
     
     # get paths
-    grid_path,infra_base_path = set_paths(local_path,base_calculation=True)[0],set_paths(local_path,base_calculation=True)[2]
+    grid_path,fetched_infra_path,infra_base_path = set_paths(local_path,base_calculation=True)[0:3]
 
     # get grid data
     grid_data = from_geofeather(grid_path) #open as geofeather
 
-    #create cisi_exposure_base for total area
-    cisi_exposure_base = {ci_system: grid_data.copy() for ci_system in infrastructure_systems}
+    # split very large areas into tiles that are calculated in parallel
+    tiles_per_area = split_areas(local_path,grid_data)
 
-    #create lists with assets per ci_system which can be used to make columns in cisi_exposure_base
-    asset_dict = {}
-    for ci_system in weight_assets:
-        asset_dict[ci_system] = []
-        for group in weight_assets[ci_system]:
-            for asset in weight_assets[ci_system][group]:
-                asset_dict[ci_system].append(asset)
+    # schedule the areas with the longest (expected) base calculations first, based on runtimes of previous runs or the size of the extracted data
+    groups_list = group_infrastructure_assets(infrastructure_systems)
+    sizes = {area: sum(file_size(os.path.join(fetched_infra_path, '{}_{}.feather'.format(area, group))) for group in groups_list) for area in areas}
+    tasks = [(area, tile) for area in areas for tile in tiles_per_area.get(area, [None])]
+    pending = [tile_name(area, tile) for area, tile in tasks if not base_calculation_done(area,infrastructure_systems,local_path,tile)]
+    tasks = schedule_tasks(tasks, tiles_per_area, set_paths(local_path,run_state=True), 'base_calculation', sizes, pending)
+    scheduled_areas = [tile_name(area, tile) for area, tile in tasks]
 
-    #get all assets as columns and set to 0
-    listofzeros = [0.0] * len(grid_data) #get list with zeros
-    for ci_system in infrastructure_systems:
-        for asset in asset_dict[ci_system]:
-            cisi_exposure_base[ci_system].insert(0, asset, listofzeros)
-            
-    #get fetched_data_dict for area
-    print('Time to start summary base calcualations for the following areas: {}'.format(areas))
-    for area in areas:        
-        for ci_system in infrastructure_systems:
-            #if os.path.isfile(os.path.join(infra_base_path, "base_per_area", '{}_{}.feather'.format(area,ci_system))) == True:
-            if cisi_exposure_per_area[area][ci_system].empty == False:
-                #grid_data_area = from_geofeather(os.path.join(infra_base_path, "base_per_area",'{}_{}.feather'.format(area,ci_system))) #open as geofeather
-                grid_data_area = cisi_exposure_per_area[area][ci_system]
-                grid_data_area.geometry = pygeos.from_wkb(grid_data_area.geometry)
-                #go through df containing basic calculations and put information in one common df
-                for asset in asset_dict[ci_system]:
-                    if '{}'.format(asset) in grid_data_area.columns:
-                        for grid_cell in grid_data_area.itertuples(index=False):
-                            if getattr(grid_cell, asset) != 0.0: 
-                                cisi_exposure_base[ci_system].loc[getattr(grid_cell, "grid_number"), "{}".format(asset)] += getattr(grid_cell, asset)
-            else:
-                print("WARNING: the following {}/{} combination does not exist".format(area, ci_system))
-                    
+    #create lists with assets per ci_system which are the columns of the summary base calculations, and preallocate the summary tables
+    asset_dict = {ci_system: assets[::-1] for ci_system, assets in assets_per_system(weight_assets).items()}
+    summary_tables = {ci_system: cellstore.empty_table(grid_data, asset_dict[ci_system]) for ci_system in infrastructure_systems}
+
+    # run the base calculation parallel per area (or tile) and add the results of each area to the summary tables as soon as they are finished (only one area is kept in memory)
+    # tiles of an area consist of different grids, so they are added to the summary tables directly
+    # make the masks that are used to select the grids of each area, before the workers start
+    prepare_country_masks(areas,set_paths(local_path,base_calculation=True)[3],set_paths(local_path,masks=True))
+
+    #listed_areas = list(areas.values())[0]
+    print('Time to start base calcualations for the following areas: {}'.format(scheduled_areas))
+    with Pool(cpu_count()-1) as pool: 
+        for area, tile, cells_base_area in pool.imap_unordered(partial(base_calculation_per_task,
+                                                        infrastructure_systems=infrastructure_systems,
+                                                        local_path=local_path),
+                                                        tasks,
+                                                        chunksize=1):
+            for ci_system in infrastructure_systems:
+                if cells_base_area[ci_system].empty == False:
+                    cellstore.add_to_table(summary_tables[ci_system], cells_base_area[ci_system], grid_data, asset_dict[ci_system])
+                elif tile is None:
+                    print("WARNING: the following {}/{} combination does not exist".format(area, ci_system))
+
+    # merge the tiles of areas that are split into tiles, so base calculations per area are available
+    for area in tiles_per_area:
+        merge_tile_base_calculations(area,tiles_per_area[area],infrastructure_systems,infra_base_path)
+    
     #and save summary base calculations as geofather
-    for ci_system in cisi_exposure_base:                                             
-        temp_df = cisi_exposure.transform_to_gpd((cisi_exposure_base[ci_system])) #transform df to gpd with shapely geometries
-        temp_df.to_file(os.path.join(infra_base_path, 'summary_basecalcs_{}.gpkg'.format(ci_system)), layer=' ', driver="GPKG")
-        to_geofeather(cisi_exposure_base[ci_system], os.path.join(infra_base_path, 'summary_basecalcs_{}.feather'.format(ci_system)), crs="EPSG:4326") #save as geofeather
-        #with Geopackage(os.path.join(infra_base_path, 'summary_basecalcs_{}.gpkg'.format(ci_system)), 'w') as out:
-        #    out.add_layer(cisi_exposure_base[ci_system], name=' ', crs='EPSG:4326')
+    print('Time to export summary base calcualations for the following areas: {}'.format(areas))
+    for ci_system in infrastructure_systems:
+        export_summary_base_calculations(summary_tables[ci_system], ci_system, grid_data, asset_dict[ci_system], infra_base_path)
     print("(Summary) base calculations are finished and data is exported")
 
 
@@ -553,49 +1215,29 @@ def base_calculations_global(local_path):
     # get grid data
     grid_data = from_geofeather(grid_path) #open as geofeather
 
-    #create cisi_exposure_base for total area
-    cisi_exposure_base = {ci_system: grid_data.copy() for ci_system in infrastructure_systems}
-
-    #create lists with assets per ci_system which can be used to make columns in cisi_exposure_base
-    asset_dict = {}
-    for ci_system in weight_assets:
-        asset_dict[ci_system] = []
-        for group in weight_assets[ci_system]:
-            for asset in weight_assets[ci_system][group]:
-                asset_dict[ci_system].append(asset)
-
-    #get all assets as columns and set to 0
-    listofzeros = [0.0] * len(grid_data) #get list with zeros
-    for ci_system in infrastructure_systems:
-        for asset in asset_dict[ci_system]:
-            cisi_exposure_base[ci_system].insert(0, asset, listofzeros)
+    #create lists with assets per ci_system which are the columns of the summary base calculations
+    asset_dict = {ci_system: assets[::-1] for ci_system, assets in assets_per_system(weight_assets).items()}
             
-    #get fetched_data_dict for area
+    #add sparse base calculations of the areas one at a time to a preallocated summary table
     print('Time to start summary base calcualations for the following areas: {}'.format(areas))
     for ci_system in infrastructure_systems:
+        summary_table = cellstore.empty_table(grid_data, asset_dict[ci_system])
         for area in areas:        
-            if os.path.isfile(os.path.join(infra_base_path, "base_per_area", '{}_{}.feather'.format(area,ci_system))) == True:
-                grid_data_area = from_geofeather(os.path.join(infra_base_path, "base_per_area",'{}_{}.feather'.format(area,ci_system))) #open as geofeather
-                if grid_data_area.empty == False:
-                    #grid_data_area.geometry = pygeos.from_wkb(grid_data_area.geometry)
-                    #go through df containing basic calculations and put information in one common df
-                    for asset in asset_dict[ci_system]:
-                        if '{}'.format(asset) in grid_data_area.columns:
-                            for grid_cell in grid_data_area.itertuples(index=False):
-                                if getattr(grid_cell, asset) != 0.0: 
-                                    cisi_exposure_base[ci_system].loc[getattr(grid_cell, "grid_number"), "{}".format(asset)] += getattr(grid_cell, asset)
-                else:
-                    print("WARNING: the {}_{} file for base calculations is empty".format(area, ci_system))
+            if os.path.isfile(os.path.join(infra_base_path, "base_per_area", '{}_{}_cells.feather'.format(area,ci_system))) == True:
+                cells_area = cellstore.load_cellstore(os.path.join(infra_base_path, "base_per_area", '{}_{}_cells.feather'.format(area,ci_system)))
+            elif os.path.isfile(os.path.join(infra_base_path, "base_per_area", '{}_{}.feather'.format(area,ci_system))) == True: #base calculations made before sparse stores were introduced
+                cells_area = cellstore.to_cellstore(from_geofeather(os.path.join(infra_base_path, "base_per_area",'{}_{}.feather'.format(area,ci_system)))) #open as geofeather
             else:
                 print("WARNING: the {}_{} file for base calculations does not exist".format(area, ci_system))
+                continue
+            if cells_area.empty == False:
+                cellstore.add_to_table(summary_table, cells_area, grid_data, asset_dict[ci_system])
+            else:
+                print("WARNING: the {}_{} file for base calculations is empty".format(area, ci_system))
         
         #calculations for each area for a specific ci_system are done. Time to export summary data for ci_system       
         print('Summary base calculations are done for {}. Will be exported now...'.format(ci_system))#and save summary base calculations as geofather                                            
-        temp_df = cisi_exposure.transform_to_gpd((cisi_exposure_base[ci_system])) #transform df to gpd with shapely geometries
-        temp_df.to_file(os.path.join(infra_base_path, 'summary_basecalcs_{}.gpkg'.format(ci_system)), layer=' ', driver="GPKG")
-        to_geofeather(cisi_exposure_base[ci_system], os.path.join(infra_base_path, 'summary_basecalcs_{}.feather'.format(ci_system)), crs="EPSG:4326") #save as geofeather
-        #with Geopackage(os.path.join(infra_base_path, 'summary_basecalcs_{}.gpkg'.format(ci_system)), 'w') as out:
-        #    out.add_layer(cisi_exposure_base[ci_system], name=' ', crs='EPSG:4326')
+        export_summary_base_calculations(summary_table, ci_system, grid_data, asset_dict[ci_system], infra_base_path)
         print("(Summary) base calculations are finished and data is exported")
 
 ################################################################
@@ -621,9 +1263,15 @@ def cisi_calculation(local_path,goal_area):
     else:
         print("Time to import the infrastructure datafiles containing the summary base calculations and put it in a dictionairy for CISI analysis")
         cisi_exposure_base = {ci_system: pd.DataFrame() for ci_system in infrastructure_systems} #use keys in infrastructure_systems to make dataframes for indices https://stackoverflow.com/questions/56217737/use-elements-in-a-list-for-dataframe-names
+        asset_dict = assets_per_system(weight_assets)
+        grid_data = None
         #import infrastructure data of each subsystem and save in dictionary
         for ci_system in infrastructure_systems:
-            if os.path.isfile(os.path.join(infra_base_path, 'summary_basecalcs_{}.feather'.format(ci_system))) == True:
+            if os.path.isfile(os.path.join(infra_base_path, 'summary_basecalcs_{}_cells.feather'.format(ci_system))) == True:
+                if grid_data is None: grid_data = from_geofeather(set_paths(local_path,base_calculation=True)[0]) #open grid as geofeather
+                cells_base = cellstore.load_cellstore(os.path.join(infra_base_path, 'summary_basecalcs_{}_cells.feather'.format(ci_system)))
+                cisi_exposure_base[ci_system] = cellstore.densify(cells_base, grid_data, asset_dict[ci_system][::-1]) #save data in dictionary
+            elif os.path.isfile(os.path.join(infra_base_path, 'summary_basecalcs_{}.feather'.format(ci_system))) == True:
                 infra_base_data = from_geofeather(os.path.join(infra_base_path, 'summary_basecalcs_{}.feather'.format(ci_system))) #open as geofeather
                 cisi_exposure_base[ci_system] = infra_base_data #save data in dictionary
             else:
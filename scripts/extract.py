@@ -9,6 +9,7 @@ import geopandas
 import pandas
 import ogr
 import os
+import re
 import numpy 
 import gdal
 import pygeos
@@ -85,51 +86,420 @@ def retrieve_shapely(osm_path,geoType,keyCol,**valConstraint):
         print("WARNING: No features or No Memory. returning empty GeoDataFrame") 
         return geopandas.GeoDataFrame(columns=['osm_id','geometry'],crs={'init': 'epsg:4326'})
     
-def retrieve(osm_path,geoType,keyCol,**valConstraint):
+#columns of each OSM layer that are used by the extraction functions of the infrastructure groups, see read_osm_layers
+LAYER_COLUMNS = {'points': ['man_made','other_tags'],
+                 'lines': ['highway','railway','power','voltage'],
+                 'multipolygons': ['aeroway','amenity','landuse','man_made','other_tags']}
+
+def query_layer(geoType,keyCol):
     """
-    Function to extract specified geometry and keys/values from OpenStreetMap using pygeos
+    This function builds an SQL query that selects all features of a layer for which at least one of the keys is not Null.
+    Arguments:
+         *geoType* : Type of geometry (osm layer) to search for.
+         *keyCol* : A list of keys/columns that should be selected from the layer.
+    Returns:
+        *string: : a SQL query string.
+    """
+    return "SELECT osm_id," + ",".join(keyCol) + " FROM " + geoType + " WHERE " + " OR ".join([a + " IS NOT NULL" for a in keyCol])
+
+#keys in the 'other_tags' column of each OSM layer that are parsed into columns by read_osm_layers, see parse_other_tags
+LAYER_TAGS = {'points': ['power','healthcare','amenity','tower:type'],
+              'multipolygons': ['power','healthcare']}
+
+CHUNK_SIZE = 100000 #number of features that are read at once from an OGR layer
+
+def wkb_to_geometries(wkb):
+    """
+    Function to convert WKB to pygeos geometries with one vectorized call. If a chunk contains invalid WKB, the geometries are converted one by one and invalid ones become None.
+    Arguments:
+        *wkb* : array with WKB (bytes or None).
+    Returns:
+        *array* : pygeos geometries.
+    """
+    try:
+        return from_wkb(wkb)
+    except Exception:
+        geometries = numpy.empty(len(wkb), dtype=object)
+        for i in range(len(wkb)):
+            try:
+                geometries[i] = from_wkb(wkb[i])
+            except Exception:
+                print("WARNING: skipped OSM feature")
+        return geometries
+
+def field_values(values):
+    """
+    Function to convert a column returned by OGR to Python values (strings are decoded, missing values become None).
+    Arguments:
+        *values* : array with values of a field.
+    Returns:
+        *array* : values as objects.
+    """
+    values = pandas.Series(numpy.asarray(values, dtype=object), dtype=object)
+    notnull = values.notnull()
+    if notnull.any() and isinstance(values[notnull].iloc[0], bytes): #fields have one type, so only string fields are decoded
+        values[notnull] = values[notnull].str.decode('utf-8')
+    return values.where(notnull, None).to_numpy(dtype=object)
+
+def arrow_chunks(sql_lyr,cl,chunk_size=CHUNK_SIZE):
+    """
+    Generator that reads an OGR layer in columnar chunks using the Arrow stream interface (GDAL >= 3.6).
+    Arguments:
+        *sql_lyr* : OGR layer, e.g. the result of an SQL query.
+        *cl* : list with the columns (fields) to read.
+        *chunk_size* : maximum number of features per chunk. Defaults to CHUNK_SIZE.
+    Returns:
+        *dictionary* : per chunk, the columns as keys and arrays with values as values, and WKB under the key 'geometry'.
+    """
+    geometry_column = sql_lyr.GetGeometryColumn() or 'wkb_geometry'
+    stream = sql_lyr.GetArrowStreamAsNumPy(options=['MAX_FEATURES_IN_BATCH={}'.format(chunk_size), 'INCLUDE_FID=NO'])
+    for batch in stream:
+        chunk = {i: field_values(batch[i]) for i in cl}
+        chunk['geometry'] = numpy.asarray(batch[geometry_column], dtype=object)
+        yield chunk
+
+def feature_chunks(sql_lyr,cl,chunk_size=CHUNK_SIZE):
+    """
+    Generator that reads an OGR layer in columnar chunks by fetching the features one by one (for GDAL builds without Arrow stream support).
+    Arguments:
+        *sql_lyr* : OGR layer, e.g. the result of an SQL query.
+        *cl* : list with the columns (fields) to read.
+        *chunk_size* : maximum number of features per chunk. Defaults to CHUNK_SIZE.
+    Returns:
+        *dictionary* : per chunk, the columns as keys and lists with values as values, and WKB under the key 'geometry'.
+    """
+    chunk = {i: [] for i in cl + ['geometry']}
+    for feature in sql_lyr:
+        try:
+            geom = feature.GetGeometryRef()
+            wkb = None if geom is None else geom.ExportToWkb()
+            values = [feature.GetField(i) for i in cl]
+        except:
+            print("WARNING: skipped OSM feature")
+            continue
+        for i, value in zip(cl, values): chunk[i].append(value)
+        chunk['geometry'].append(wkb)
+        if len(chunk['geometry']) == chunk_size:
+            yield chunk
+            chunk = {i: [] for i in cl + ['geometry']}
+    if len(chunk['geometry']) > 0:
+        yield chunk
+
+def chunk_to_dataframe(chunk,cl,required=None):
+    """
+    Function to convert a chunk of features (see arrow_chunks and feature_chunks) to a DataFrame with pygeos geometries.
+    Arguments:
+        *chunk* : dictionary with the columns as keys and values as values, and WKB under the key 'geometry'.
+        *cl* : list with the columns (fields) of the chunk.
+        *required* : column that should not be Null. Optional, features with a Null value in this column are skipped. 
+    Returns:
+        *DataFrame* : a frame with the columns *cl*, geometries as objects. Features without geometry are skipped.
+    """
+    df = pandas.DataFrame({i: numpy.asarray(chunk[i], dtype=object) for i in cl})
+    df['geometry'] = wkb_to_geometries(numpy.asarray(chunk['geometry'], dtype=object))
+    keep = df['geometry'].notnull()
+    if required is not None:
+        keep &= df[required].notnull()
+    return df.loc[keep]
+
+def layer_to_dataframe(sql_lyr,cl,required=None,chunk_size=CHUNK_SIZE):
+    """
+    Function to read the features of an OGR (SQL) layer into a DataFrame with pygeos geometries. Features are read in columnar chunks and each chunk is converted (incl. its WKB at once) as it is read, so only the converted features are kept in memory.
+    Arguments:
+        *sql_lyr* : OGR layer, e.g. the result of an SQL query.
+        *cl* : list with the columns (fields) to read.
+        *required* : column that should not be Null. Optional, features with a Null value in this column are skipped. 
+        *chunk_size* : maximum number of features per chunk. Defaults to CHUNK_SIZE.
+    Returns:
+        *DataFrame* : a frame with the columns *cl*, geometries as objects.    
+    """
+    if hasattr(sql_lyr, 'GetArrowStreamAsNumPy'):
+        try:
+            frames = [chunk_to_dataframe(chunk,cl,required) for chunk in tqdm(arrow_chunks(sql_lyr,cl,chunk_size))]
+        except Exception as e: #e.g. GDAL is build without support for Arrow or numpy
+            print("WARNING: Arrow stream could not be read ({}), features will be fetched one by one".format(e))
+            sql_lyr.ResetReading()
+            frames = [chunk_to_dataframe(chunk,cl,required) for chunk in tqdm(feature_chunks(sql_lyr,cl,chunk_size))]
+    else:
+        frames = [chunk_to_dataframe(chunk,cl,required) for chunk in tqdm(feature_chunks(sql_lyr,cl,chunk_size))]
+
+    if len(frames) == 0:
+        return pandas.DataFrame(columns=cl+['geometry'])
+    return pandas.concat(frames, ignore_index=True)
+
+def parse_other_tags(df,keys,column='other_tags',drop=True):
+    """
+    Function to parse the 'other_tags' column of OSM data (hstore format: "key"=>"value","key2"=>"value2") with vectorized string operations. 
+    Each requested key becomes a column with its value (None if the key is absent), so filters on tags become column comparisons.
+    Arguments:
+        *df* : DataFrame with a column with hstore-formatted tags.
+        *keys* : list with the keys that become columns. Existing columns with the same name are overwritten.
+        *column* : name of the column with the tags. Defaults to 'other_tags'.
+        *drop* : if True, the column with the tags is dropped after parsing to free memory. Defaults to True.
+    Returns:
+        *DataFrame* : *df* with a column per key.
+    """
+    df = df.copy()
+    if column not in df.columns:
+        tags = pandas.Series(None, index=df.index, dtype=object)
+    else:
+        tags = df[column].astype(object)
+    for key in keys:
+        values = tags.str.extract('(?:^|,)"{}"=>"((?:[^"\\\\]|\\\\.)*)"'.format(re.escape(key)), expand=False)
+        df[key] = values.astype(object).where(values.notnull(), None)
+    if drop and column in df.columns:
+        df = df.drop([column], axis=1)
+    return df
+
+def ogr_spatial_filter(spatial_filter):
+    """
+    Function to convert a spatial filter to an OGR geometry
+    Arguments:
+        *spatial_filter* : bounding box (xmin, ymin, xmax, ymax) or pygeos geometry (WGS-84). 
+    Returns:
+        *ogr.Geometry* : the spatial filter as OGR geometry, None if *spatial_filter* is None.
+    """
+    if spatial_filter is None:
+        return None
+    if not isinstance(spatial_filter, pygeos.Geometry):
+        spatial_filter = pygeos.box(*spatial_filter)
+    return ogr.CreateGeometryFromWkb(pygeos.to_wkb(spatial_filter))
+
+def filter_spatially(df,spatial_filter,spat_tree=None):
+    """
+    Function to select the features of a frame that intersect a spatial filter, equivalent to the spatial filter that OGR applies when reading an OSM-file.
+    Arguments:
+        *df* : frame with pygeos geometries (WGS-84) in column geometry.
+        *spatial_filter* : bounding box (xmin, ymin, xmax, ymax), pygeos geometry or array with pygeos geometries (WGS-84). 
+        *spat_tree* : STRtree of the geometries of *df*. Optional, built if not given (pass it when *df* is filtered repeatedly).
+    Returns:
+        *DataFrame* : the rows of *df* that intersect (one of the geometries of) *spatial_filter*, in their original order. *df* itself if *spatial_filter* is None.
+    """
+    if spatial_filter is None or df.empty:
+        return df
+    if spat_tree is None:
+        spat_tree = pygeos.STRtree(df.geometry.values)
+    if isinstance(spatial_filter, numpy.ndarray):
+        return df.iloc[numpy.unique(spat_tree.query_bulk(spatial_filter,predicate='intersects')[1])]
+    if not isinstance(spatial_filter, pygeos.Geometry):
+        spatial_filter = pygeos.box(*spatial_filter)
+    return df.iloc[numpy.sort(spat_tree.query(spatial_filter,predicate='intersects'))]
+
+def read_osm_layers(osm_path,layer_columns=LAYER_COLUMNS,layer_tags=LAYER_TAGS,spatial_filter=None):
+    """
+    Function to read the OSM layers that are required for all infrastructure groups, with one pass over the pbf-file per layer. 
+    The result can be passed to the extraction functions instead of *osm_path*, so that all groups are extracted from the same pass.
     Arguments:
         *osm_path* : file path to the .osm.pbf file of the region 
         for which we want to do the analysis.     
+        *layer_columns* : dictionary with layers (points, lines, multipolygons) as keys and the keys/columns to read as values. Defaults to LAYER_COLUMNS.
+        *layer_tags* : dictionary with layers as keys and the keys in 'other_tags' that are parsed into columns as values (the raw 'other_tags' are not kept). Defaults to LAYER_TAGS.
+        *spatial_filter* : bounding box (xmin, ymin, xmax, ymax) or pygeos geometry. Optional, if given only features intersecting it are read (applied by OGR, before features are converted).
+    Returns:
+        *dictionary* : layers as keys and a frame with the features that have at least one of the keys as value.    
+    """
+    driver=ogr.GetDriverByName('OSM')
+    data = driver.Open(osm_path)
+    osm_layers = {}
+    for geoType in layer_columns:
+        if data is None:
+            print("ERROR: Nonetype error when opening OSM-file. Check required.")
+            osm_layers[geoType] = pandas.DataFrame(columns=['osm_id']+layer_columns[geoType]+['geometry'])
+            continue
+        print('Reading {} layer of OSM-file'.format(geoType))
+        sql_lyr = data.ExecuteSQL(query_layer(geoType,layer_columns[geoType]),spatialFilter=ogr_spatial_filter(spatial_filter))
+        osm_layers[geoType] = layer_to_dataframe(sql_lyr,['osm_id']+layer_columns[geoType])
+        data.ReleaseResultSet(sql_lyr)
+        if geoType in layer_tags: #parse tags, the raw 'other_tags' are dropped afterwards
+            osm_layers[geoType] = parse_other_tags(osm_layers[geoType],layer_tags[geoType])
+    return osm_layers
+
+def prefilter_layer(df,keys):
+    """
+    Function to select the features of an OSM layer that carry at least one of the keys, e.g. to store only the features that are relevant for the infrastructure groups.
+    Arguments:
+        *df* : frame with an OSM layer (see read_osm_layers).
+        *keys* : list with keys/columns (and parsed tags) of *df*.
+    Returns:
+        *DataFrame* : the rows of *df* for which at least one of *keys* is not Null.
+    """
+    keys = [a for a in keys if a in df.columns]
+    if len(keys) == 0:
+        return df
+    return df.loc[df[keys].notnull().any(axis=1).values].reset_index(drop=True)
+
+def layer_to_table(df):
+    """
+    Function to convert an OSM layer to a table that can be saved in a columnar format (e.g. feather), with the geometries as WKB.
+    Arguments:
+        *df* : frame with an OSM layer with pygeos geometries.
+    Returns:
+        *DataFrame* : *df* with the geometries in column geometry as WKB.
+    """
+    return df.assign(geometry=pygeos.to_wkb(df.geometry.values)).reset_index(drop=True)
+
+def table_to_layer(df):
+    """
+    Function to convert a table with WKB geometries (see layer_to_table) back to an OSM layer, which can be passed to the extraction functions (see read_osm_layers).
+    Arguments:
+        *df* : frame with the geometries in column geometry as WKB.
+    Returns:
+        *DataFrame* : *df* with pygeos geometries.
+    """
+    return df.assign(geometry=wkb_to_geometries(df.geometry.values))
+
+def constraint_mask(df,keyCol,**valConstraint):
+    """
+    Function to evaluate the constraints of the retrieve() function on a frame, equivalent to the SQL query of query_b().
+    Arguments:
+         *df* : frame with (at least) the keys/columns in *keyCol* and *valConstraint*.
+         *keyCol* : A list of keys/columns, the first key/col should not be Null.
+         ***valConstraint* : A dictionary of constraints for the values, e.g. {'power':["='cable' or ","='line'"]} or {'voltage':[" IS NULL"]}
+    Returns:
+        *Series* : boolean mask of the rows that satisfy the constraints.
+    """
+    mask = pandas.Series(not valConstraint, index=df.index) 
+    for a in valConstraint:
+        for b in valConstraint[a]:
+            b = b.strip()
+            if b.lower().endswith(' or'): b = b[:-3].strip() #constraints are combined with 'or'
+            if b.upper() == 'IS NULL':
+                mask |= df[a].isnull()
+            elif b.upper() == 'IS NOT NULL':
+                mask |= df[a].notnull()
+            elif b.startswith('='):
+                mask |= df[a] == b[1:].strip("'")
+            else:
+                raise ValueError("Constraint '{}{}' is not supported for OSM layers that are already read".format(a, b))
+    return mask & df[keyCol[0]].notnull() # Always ensures the first key/col provided is not Null.
+
+def retrieve(osm_path,geoType,keyCol,spatial_filter=None,**valConstraint):
+    """
+    Function to extract specified geometry and keys/values from OpenStreetMap using pygeos
+    Arguments:
+        *osm_path* : file path to the .osm.pbf file of the region 
+        for which we want to do the analysis. Or a dictionary with the OSM layers that are already read (see read_osm_layers).     
         *geoType* : Type of Geometry to retrieve. e.g. lines, multipolygons, etc.
         *keyCol* : These keys will be returned as columns in the dataframe.
+        *spatial_filter* : bounding box (xmin, ymin, xmax, ymax) or pygeos geometry. Optional, if given only features intersecting it are returned. 
+        When reading an OSM-file, the filter is applied by OGR, so features outside of it are never converted.
         ***valConstraint: A dictionary specifiying the value constraints.  
         A key can have multiple values (as a list) for more than one constraint for key/value.  
     Returns:
         *Panda Core Series* : a frame with all columns, geometries as objects, and constraints specified.    
     """
-    driver=ogr.GetDriverByName('OSM')
-    data = driver.Open(osm_path)
-    query = query_b(geoType,keyCol,**valConstraint)
-    sql_lyr = data.ExecuteSQL(query)
-    features =[]
-    # cl = columns 
     cl = ['osm_id'] 
     for a in keyCol: cl.append(a)
-    if data is not None:
-        print('query is finished, lets start the loop')
-        for feature in tqdm(sql_lyr):
-            try:
-                if feature.GetField(keyCol[0]) is not None:
-                    geom = from_wkb(feature.geometry().ExportToWkb()) 
-                    if geom is None:
-                        continue
-                    # field will become a row in the dataframe.
-                    field = []
-                    for i in cl: field.append(feature.GetField(i))
-                    field.append(geom)   
-                    features.append(field)
-            except:
-                print("WARNING: skipped OSM feature")   
+    if isinstance(osm_path, dict): #select features from layers that are already read
+        layer = osm_path[geoType]
+        missing = [a for a in keyCol + list(valConstraint) if a not in layer.columns]
+        if len(missing) > 0:
+            raise ValueError("Columns {} are not read for layer '{}', add them to the layer_columns of read_osm_layers".format(missing, geoType))
+        df = filter_spatially(layer.loc[constraint_mask(layer,keyCol,**valConstraint), cl+['geometry']],spatial_filter).reset_index(drop=True)
     else:
-        print("ERROR: Nonetype error when requesting SQL. Check required.")    
-    cl.append('geometry')                   
-    if len(features) > 0:
-        return pandas.DataFrame(features,columns=cl)
+        driver=ogr.GetDriverByName('OSM')
+        data = driver.Open(osm_path)
+        if data is not None:
+            query = query_b(geoType,keyCol,**valConstraint)
+            sql_lyr = data.ExecuteSQL(query,spatialFilter=ogr_spatial_filter(spatial_filter))
+            print('query is finished, lets start the loop')
+            df = layer_to_dataframe(sql_lyr,cl,required=keyCol[0])
+        else:
+            print("ERROR: Nonetype error when requesting SQL. Check required.")    
+            df = pandas.DataFrame()
+    if len(df) > 0:
+        return df
     else:
         print("WARNING: No features or No Memory. returning empty GeoDataFrame") 
         return pandas.DataFrame(columns=['osm_id','geometry'])  
     
+def retrieve_tags(osm_path,geoType,tags,keyCol=[],columns=[],spatial_filter=None,**valConstraint):
+    """
+    Function to extract features with specified tags (stored in 'other_tags') from OpenStreetMap, with the parsed tags as columns 
+    Arguments:
+        *osm_path* : file path to the .osm.pbf file of the region 
+        for which we want to do the analysis. Or a dictionary with the OSM layers that are already read (see read_osm_layers).     
+        *geoType* : Type of Geometry to retrieve. e.g. lines, multipolygons, etc.
+        *tags* : These keys in 'other_tags' will be returned as columns in the dataframe.
+        *keyCol* : These keys will be returned as columns in the dataframe. Optional, if empty only features with at least one of *tags* are returned.
+        *columns* : These keys will be returned as columns in the dataframe without constraints (may be Null), e.g. 'other_tags' to keep the raw tags. Optional.
+        *spatial_filter* : bounding box (xmin, ymin, xmax, ymax) or pygeos geometry. Optional, if given only features intersecting it are returned (see retrieve()).
+        ***valConstraint: A dictionary specifiying the value constraints on *keyCol*, see retrieve().  
+    Returns:
+        *DataFrame* : a frame with osm_id, *keyCol*, *columns*, *tags* and geometry columns.    
+    """
+    cl = ['osm_id'] + keyCol + columns + tags + ['geometry']
+    if isinstance(osm_path, dict) and all(a in osm_path[geoType].columns for a in tags + columns): #tags are already parsed by read_osm_layers
+        layer = osm_path[geoType]
+        if len(keyCol) > 0:
+            mask = constraint_mask(layer,keyCol,**valConstraint)
+        else:
+            mask = layer[tags].notnull().any(axis=1)
+        return filter_spatially(layer.loc[mask, cl],spatial_filter).reset_index(drop=True)
+    
+    extra = [a for a in columns if a != 'other_tags']
+    df = parse_other_tags(retrieve(osm_path,geoType,keyCol+['other_tags']+extra,spatial_filter=spatial_filter,**valConstraint),tags,drop='other_tags' not in columns)
+    if len(keyCol) == 0:
+        df = df.loc[df[tags].notnull().any(axis=1)]
+    return df.reindex(columns=cl).reset_index(drop=True)
+
+def retrieve_values(osm_path,geoType,key,values=None):
+    """
+    Function to extract features with specified values of a key from OpenStreetMap, with the values as asset column 
+    Arguments:
+        *osm_path* : file path to the .osm.pbf file of the region 
+        for which we want to do the analysis. Or a dictionary with the OSM layers that are already read (see read_osm_layers).     
+        *geoType* : Type of Geometry to retrieve. e.g. lines, multipolygons, etc.
+        *key* : key/column of which the values are returned as asset, e.g. 'highway'.
+        *values* : list with the values of *key* that are extracted. Optional, all features with *key* are extracted if None.
+    Returns:
+        *DataFrame* : a frame with osm_id, asset and geometry columns.    
+    """
+    valConstraint = {}
+    if values is not None:
+        valConstraint[key] = ["='{}' or ".format(value) for value in values[:-1]] + ["='{}'".format(values[-1])]
+    return retrieve(osm_path,geoType,[key],**valConstraint).rename(columns={key: 'asset'})
+
+def reclassify_assets(df,keep=None,mapping=None):
+    """
+    Function to lowercase, filter and reclassify the assets of extracted features. Each distinct asset is processed once (as categorical), instead of each row.
+    Arguments:
+        *df* : frame with an asset column.
+        *keep* : list with the (lowercase) assets that are kept. Optional, all assets are kept if None.
+        *mapping* : dictionary with the (lowercase) assets as keys and their new class as values. Optional, assets are not reclassified if None.
+    Returns:
+        *DataFrame* : the rows of *df* with a kept asset, with the lowercase (and reclassified) asset.    
+    """
+    assets = df['asset'].astype('category')
+    codes = assets.cat.codes.values
+    categories = assets.cat.categories.astype(str).str.lower()
+    kept = numpy.ones(len(categories), dtype=bool) if keep is None else numpy.asarray(categories.isin(keep))
+    if mapping is not None:
+        unmapped = sorted(set(categories[kept]) - set(mapping))
+        if len(unmapped) > 0:
+            raise KeyError("Assets {} are not in the mapping for reclassification".format(unmapped))
+        categories = categories.map(lambda x: mapping.get(x))
+    rows = (codes >= 0) & kept[codes] #rows with Null asset are dropped
+
+    df = df.loc[rows].copy()
+    df['asset'] = numpy.asarray(categories, dtype=object)[codes[rows]]
+    return df
+
+def compact_dtypes(df):
+    """
+    Function to give extracted features a compact schema: asset as categorical, osm_id as (nullable) integer and no index columns left by reset_index().
+    Arguments:
+        *df* : frame with extracted features.
+    Returns:
+        *DataFrame* : *df* with compact dtypes.    
+    """
+    df = df.drop(columns=[col for col in ['index', 'level_0'] if col in df.columns]).reset_index(drop=True)
+    if 'asset' in df.columns:
+        df['asset'] = df['asset'].astype('category')
+    if 'osm_id' in df.columns:
+        df['osm_id'] = pandas.to_numeric(df['osm_id'], errors='coerce').astype('Int64') #osm_id is Null for some multipolygons
+    return df
+
 def merge_energy_datatypes(osm_path):
     """
     Function to extract and merge energy assets with different datatypes from OpenStreetMap  
@@ -209,15 +579,10 @@ def power_polygon(osm_path):
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with specified unique energy linestrings.
     """   
-    df = retrieve(osm_path,'multipolygons',['other_tags']) 
-    
-    df = df.loc[(df.other_tags.str.contains('power'))]   #keep rows containing power data         
-    df = df.reset_index(drop=True).rename(columns={'other_tags': 'asset'})     
-    
-    df['asset'].loc[df['asset'].str.contains('"power"=>"substation"', case=False)]  = 'substation' #specify row
-    df['asset'].loc[df['asset'].str.contains('"power"=>"plant"', case=False)] = 'plant' #specify row
+    df = retrieve_tags(osm_path,'multipolygons',['power']) #keep rows containing power data
     
-    df = df.loc[(df.asset == 'substation') | (df.asset == 'plant')]
+    df['asset'] = df['power'].str.lower() #specify row
+    df = df.loc[df.asset.isin(['substation','plant']), ['osm_id','asset','geometry']]
             
     return df.reset_index(drop=True) 
 
@@ -230,15 +595,10 @@ def power_point(osm_path):
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with specified unique energy linestrings.
     """   
-    df = retrieve(osm_path,'points',['other_tags']) 
-    
-    df = df.loc[(df.other_tags.str.contains('power'))]  #keep rows containing power data       
-    df = df.reset_index(drop=True).rename(columns={'other_tags': 'asset'})     
-    
-    df['asset'].loc[df['asset'].str.contains('"power"=>"tower"', case=False)]  = 'power_tower' #specify row
-    df['asset'].loc[df['asset'].str.contains('"power"=>"pole"', case=False)] = 'power_pole' #specify row
+    df = retrieve_tags(osm_path,'points',['power']) #keep rows containing power data
     
-    df = df.loc[(df.asset == 'power_tower') | (df.asset == 'power_pole')]
+    df['asset'] = ('power_' + df['power'].str.lower()) #specify row
+    df = df.loc[df.asset.isin(['power_tower','power_pole']), ['osm_id','asset','geometry']]
             
     return df.reset_index(drop=True)   
 
@@ -503,6 +863,29 @@ def telecom(osm_path):
     else:
         return combined_df[["osm_id","asset","geometry"]] 
 
+def retrieve_towers(osm_path,man_made,tags=['tower:type']):
+    """
+    Function to extract tower or mast nodes from OpenStreetMap with the parsed 'tower:type' tag, see telecom_mast() and telecom_towers_small()
+    Arguments:
+        *osm_path* : file path to the .osm.pbf file of the region 
+        for which we want to do the analysis. Or a dictionary with the OSM layers that are already read (see read_osm_layers).       
+        *man_made* : value of the key 'man_made', e.g. 'tower' or 'mast'
+        *tags* : keys in 'other_tags' that are returned as columns. Defaults to ['tower:type'].
+    Returns:
+        *DataFrame* : a frame with osm_id, man_made, *tags* and geometry columns.
+    """ 
+    return retrieve_tags(osm_path,'points',tags,keyCol=['man_made'],**{"man_made":["='{}'".format(man_made)]})
+
+def communication_mask(df):
+    """
+    Function to select the towers that are specifically functioning as telecommunication tower, i.e. with a 'tower:type' tag starting with 'communication'
+    Arguments:
+        *df* : frame with a parsed 'tower:type' column (see retrieve_towers)
+    Returns:
+        *Series* : boolean mask, False for towers without 'tower:type'
+    """ 
+    return df['tower:type'].astype(object).str.startswith('communication', na=False)
+
 def telecom_mast(osm_path):
     """
     Function to extract telecommunication masts nodes from OpenStreetMap. See detailted information telecommunication masts: https://wiki.openstreetmap.org/wiki/Tag%3Aman_made%3Dmastr   
@@ -512,16 +895,10 @@ def telecom_mast(osm_path):
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with all unique telecommunication tower nodes.
     """ 
-    df = retrieve(osm_path,'points',['man_made','other_tags'],**{"man_made":["='mast'"]}).rename(columns={'man_made': 'asset'}) 
+    df = retrieve_towers(osm_path,'mast').rename(columns={'man_made': 'asset'}) 
     
     #only towers that are specifically functioning as telecommunication tower will be saved 
-    for row in df.itertuples():
-        if df.loc[row.Index, "other_tags"] == None:
-            df = df.drop(row.Index)
-        elif not 'tower:type"=>"communication' in df.loc[row.Index, "other_tags"]:
-            df = df.drop(row.Index)
-            
-    return df.reset_index(drop=True) 
+    return df.loc[communication_mask(df).values].drop(columns=['tower:type']).reset_index(drop=True) 
 
 def telecom_towers(osm_path):
     """
@@ -560,16 +937,10 @@ def telecom_towers_small(osm_path):
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with all unique telecommunication tower nodes.
     """ 
-    df = retrieve(osm_path,'points',['man_made','other_tags'],**{"man_made":["='tower'"]}).rename(columns={'man_made': 'asset'}) 
+    df = retrieve_towers(osm_path,'tower').rename(columns={'man_made': 'asset'}) 
     
     #only towers that are specifically functioning as telecommunication tower will be saved 
-    for row in df.itertuples():
-        if df.loc[row.Index, "other_tags"] == None:
-            df = df.drop(row.Index)
-        elif not 'tower:type"=>"communication' in df.loc[row.Index, "other_tags"]:
-            df = df.drop(row.Index)
-            
-    return df.reset_index(drop=True) 
+    return df.loc[communication_mask(df).values].drop(columns=['tower:type']).reset_index(drop=True) 
 
 def telecom_towers_small2(osm_path):
     """
@@ -581,35 +952,25 @@ def telecom_towers_small2(osm_path):
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with all unique telecom nodes.
     """ 
-    df = retrieve(osm_path,'points',['man_made','other_tags'],**{"man_made":["='tower'"]})
+    df = retrieve_towers(osm_path,'tower')
     
-    telecom_towers = geopandas.GeoDataFrame(columns=['osm_id','man_made','other_tags','geometry'])
-
-    for row in range(len(df.index)):
-        if df["other_tags"][row] != None:
-            if 'tower:type"=>"communication' in df["other_tags"][row]:
-                telecom_towers = telecom_towers.append(df.loc[row])
-            
-    return telecom_towers.reset_index(drop=True)
+    return df.loc[communication_mask(df).values].drop(columns=['tower:type']).reset_index(drop=True)
 
 def telecom_towers_small1(osm_path):
     """
     Function to extract small telecommunication tower nodes from OpenStreetMap. Please note that when using this function, 
-    that towers that are missing additional information stored under 'other tags' are included as well in final output 
+    that towers that are missing additional information stored under 'other tags' (i.e. none of the tags in LAYER_TAGS) are included as well in final output 
     Arguments:
         *osm_path* : file path to the .osm.pbf file of the region 
         for which we want to do the analysis.       
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with all unique telecom nodes.
     """ 
-    df = retrieve(osm_path,'points',['man_made','other_tags'],**{"man_made":["='tower'"]}).rename(columns={'man_made': 'asset'}) 
+    df = retrieve_towers(osm_path,'tower',LAYER_TAGS['points']).rename(columns={'man_made': 'asset'}) 
 
-    for row in reversed(range(len(df.index))):
-        if df["other_tags"][row] != None:
-            if not 'tower:type"=>"communication' in df["other_tags"][row]:
-                df = df.drop(df.index[row])
-                
-    return df.reset_index(drop=True)
+    #towers without any of the parsed tags are kept
+    no_tags = df[LAYER_TAGS['points']].isnull().all(axis=1)
+    return df.loc[(no_tags | communication_mask(df)).values].drop(columns=LAYER_TAGS['points']).reset_index(drop=True)
 
 def social_amenity(osm_path):
     """
@@ -622,47 +983,41 @@ def social_amenity(osm_path):
     """   
     return (retrieve(osm_path,'multipolygons',['amenity'],**{'amenity':["='hospital' or ","='doctors' or ","='clinic' or ","='dentist' or ","='pharmacy'"]})).rename(columns={'amenity': 'asset'}) 
 
+#classification of healthcare assets: value of the tag 'healthcare' and asset name (consistent with asset list)
+HEALTHCARE_ASSETS = {"doctor" : "doctors",
+                     "pharmacy" : "pharmacy",
+                     "hospital" : "hospital",
+                     "clinic" : "clinic",
+                     "dentist" : "dentist",
+                     "physiotherapist" : "physiotherapist",
+                     "alternative" : "alternative",
+                     "laboratory" : "laboratory",
+                     "optometrist" : "optometrist",
+                     "rehabilitation" : "rehabilitation",
+                     "blood_donation" : "blood_donation",
+                     "birthing_center" : "birthing_center"}
+
+#classification of healthcare assets: value of the tag 'amenity' and asset name. Note that this list of assets should be similar to assets extracted in def social_amenity
+AMENITY_HEALTHCARE_ASSETS = {"doctors" : "doctors",
+                             "pharmacy" : "pharmacy",
+                             "hospital" : "hospital",
+                             "clinic" : "clinic",
+                             "dentist" : "dentist"}
+
 def healthcare_filter(df_all):
     """
     Function for consistently formatting of extracted healthcare data    
     Arguments:
-        *df_all* : DataFrame with extracted assets that are categorized under key 'healthcare'        
+        *df_all* : DataFrame with extracted assets with the parsed tag 'healthcare' as column (see parse_other_tags)        
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with specified unique healthcare polygons with correct format.
     """   
-    #get requested assets under healthcare tag           
-    df_filtered = pandas.DataFrame(columns=['osm_id','asset','geometry']) #create df for saving data
-    for row in range(len(df_all.index)): 
-        if 'healthcare' in df_all["asset"][row]: #check if healthcare key is present
-            df_filtered = df_filtered.append(df_all.loc[row]) #if so, save in df       
-            if '"healthcare"=>"doctor"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'doctors' #to be consistent with asset list 
-            elif '"healthcare"=>"pharmacy"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'pharmacy'
-            elif '"healthcare"=>"hospital"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'hospital'
-            elif '"healthcare"=>"clinic"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'clinic'
-            elif '"healthcare"=>"dentist"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'dentist'
-            elif '"healthcare"=>"physiotherapist"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'physiotherapist'
-            elif '"healthcare"=>"alternative"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'alternative'
-            elif '"healthcare"=>"laboratory"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'laboratory'
-            elif '"healthcare"=>"optometrist"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'optometrist'
-            elif '"healthcare"=>"rehabilitation"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'rehabilitation'
-            elif '"healthcare"=>"blood_donation"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'blood_donation'
-            elif '"healthcare"=>"birthing_center"' in df_filtered["asset"][row]:
-                df_filtered["asset"][row] = 'birthing_center'
-            else:
-                df_filtered = df_filtered.drop(index=row)
+    #get requested assets under healthcare tag and classify them with lookup table. Values are matched on their start, so multi-valued or suffixed values (e.g. 'doctor;pharmacy' or 'clinic ') are classified by their first value          
+    prefix = df_all['healthcare'].astype(object).str.extract('^({})'.format('|'.join(re.escape(value) for value in HEALTHCARE_ASSETS)), expand=False)
+    df_filtered = df_all.loc[prefix.notnull().values]
+    df_filtered = df_filtered.assign(asset=prefix[prefix.notnull()].map(HEALTHCARE_ASSETS).values)
                 
-    return df_filtered
+    return df_filtered[['osm_id','asset','geometry']]
 
 def social_healthcare(osm_path):
     """
@@ -672,14 +1027,10 @@ def social_healthcare(osm_path):
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with specified unique healthcare polygons.
     """   
-    df_all = retrieve(osm_path,'multipolygons',['other_tags', 'amenity']).rename(columns={'other_tags': 'asset'}) 
+    df_all = retrieve_tags(osm_path,'multipolygons',['healthcare'],columns=['amenity'])
     
     #delete rows that are duplicates of social_amenity
-    asset_list = ['hospital', 'doctors', 'clinic', 'dentist', 'pharmacy'] #note that this list of assets should be similar to assets extracted in def social_amenity
-    for asset in asset_list:
-        index_delete = df_all[(df_all['amenity'] == asset)].index
-        df_all.drop(index_delete,inplace=True)
-    df_all = df_all.drop(['amenity'], axis=1).reset_index(drop=True) #drop amenity column, reset index
+    df_all = df_all.loc[~df_all['amenity'].isin(list(AMENITY_HEALTHCARE_ASSETS))]
     
     #get requested assets           
     df = healthcare_filter(df_all)
@@ -707,32 +1058,16 @@ def social_infrastructure_point(osm_path):
     Returns:
         *GeoDataFrame* : a geopandas GeoDataFrame with specified unique healthcare point data.
     """   
-    df_all = retrieve(osm_path,'points',['other_tags']).rename(columns={'other_tags': 'asset'}) 
+    df_all = retrieve_tags(osm_path,'points',['healthcare','amenity'])
     
     #get requested healthcare assets categorized under the key 'healthcare' with correct formatting          
     df_h = healthcare_filter(df_all)
                 
-    #get requested healthcare assets categorized under the key 'amenity'           
-    df_a = pandas.DataFrame(columns=['osm_id','asset','geometry']) #create df for saving data
-    for row in range(len(df_all.index)): 
-        if 'amenity' in df_all["asset"][row]: 
-            if not 'healthcare' in df_all["asset"][row]: #check if healthcare key is present
-                df_a = df_a.append(df_all.loc[row]) #if so, save in df
+    #get requested healthcare assets categorized under the key 'amenity', if the point has no 'healthcare' tag           
+    df_a = df_all.loc[df_all['amenity'].isin(list(AMENITY_HEALTHCARE_ASSETS)) & df_all['healthcare'].isnull()]
+    df_a = df_a.assign(asset=df_a['amenity'].map(AMENITY_HEALTHCARE_ASSETS))
                 
-                if '"amenity"=>"doctors"' in df_a["asset"][row]:
-                    df_a["asset"][row] = 'doctors' #to be consistent with asset list 
-                elif '"amenity"=>"pharmacy"' in df_a["asset"][row]:
-                    df_a["asset"][row] = 'pharmacy'
-                elif '"amenity"=>"hospital"' in df_a["asset"][row]:
-                    df_a["asset"][row] = 'hospital'
-                elif '"amenity"=>"clinic"' in df_a["asset"][row]:
-                    df_a["asset"][row] = 'clinic'
-                elif '"amenity"=>"dentist"' in df_a["asset"][row]:
-                    df_a["asset"][row] = 'dentist'
-                else:
-                    df_a = df_a.drop(index=row)
-                
-    df_social_points = df_a.append(df_h)
+    df_social_points = pandas.concat([df_a[['osm_id','asset','geometry']], df_h])
                 
     return df_social_points.reset_index(drop=True)
 
@@ -746,16 +1081,17 @@ def compare_polygon_to_point(df_point, df_polygon):
         *GeoDataFrame* : a geopandas GeoDataFrame with specified unique healthcare assets
     """   
 
-    #check for each polygon which points are overlaying with it 
+    #check for all polygons at once which points are overlaying with it 
     df_polygon['geometry'] = pygeos.buffer(df_polygon.geometry,0) #avoid intersection
     spat_tree = pygeos.STRtree(df_point.geometry) # https://pygeos.readthedocs.io/en/latest/strtree.html
-    for polygon_row in df_polygon.itertuples():
-        df_point_overlap = (df_point.loc[spat_tree.query(polygon_row.geometry,predicate='intersects').tolist()]).sort_index(ascending=True) #get point that overlaps with polygon
-        if not df_point_overlap.empty:
-            if polygon_row.asset in df_point_overlap['asset'].tolist():
-                df_polygon = df_polygon.drop(polygon_row.Index)
+    polygon_index, point_index = spat_tree.query_bulk(df_polygon.geometry.values,predicate='intersects') #pairs of polygons and points that overlap
+    
+    #drop polygons that overlap with a point of the same asset type
+    duplicate = df_polygon['asset'].values[polygon_index] == df_point['asset'].values[point_index]
+    drop = numpy.zeros(len(df_polygon), dtype=bool)
+    drop[polygon_index[duplicate]] = True
     
-    return df_polygon.reset_index(drop=True)
+    return df_polygon.loc[~drop].reset_index(drop=True)
 
 def social_infrastructure_combined(osm_path):
     """
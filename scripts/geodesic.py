@@ -0,0 +1,64 @@
+"""
+Geodesic length and area of geometries with WGS-84 coordinates (in Pygeos format), measured on the ellipsoid for whole arrays at once.
+Lengths are summed from batched geodesic distances between consecutive coordinates. Areas are computed in the (ellipsoidal) Lambert cylindrical equal-area projection, which preserves areas everywhere on earth, so no UTM zone needs to be chosen.
+"""
+
+import numpy as np
+import pyproj
+import pygeos
+
+GEOD = pyproj.Geod(ellps='WGS84')
+EQUAL_AREA = pyproj.Transformer.from_crs("epsg:4326", "+proj=cea +ellps=WGS84 +lat_ts=0 +units=m", always_xy=True)
+
+def segment_length(x0, y0, x1, y1):
+    """geodesic length of line segments
+    Arguments:
+        *x0*, *y0*: arrays with longitude and latitude of the start of each segment
+        *x1*, *y1*: arrays with longitude and latitude of the end of each segment
+
+    Returns:
+        array with length of each segment in meters
+    """
+    if len(x0) == 0:
+        return np.zeros(0)
+
+    return GEOD.inv(x0, y0, x1, y1)[2]
+
+def line_length(geometries):
+    """geodesic length of (multi)linestrings. For (multi)polygons the length of the boundary is returned
+    Arguments:
+        *geometries*: array with WGS-84 coordinates in Pygeos format
+
+    Returns:
+        array with length of each geometry in meters
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    polygons = np.isin(pygeos.get_type_id(geometries), [3, 6])
+    if polygons.any():
+        geometries = geometries.copy()
+        geometries[polygons] = pygeos.boundary(geometries[polygons])
+
+    parts, geometry_index = pygeos.get_parts(geometries, return_index=True) #split multi-geometries in single parts
+    coords, part_index = pygeos.get_coordinates(parts, return_index=True) #flattened coordinates with the part they belong to
+    segment = part_index[1:] == part_index[:-1] #consecutive coordinates of the same part form a segment
+
+    length = segment_length(coords[:-1,0][segment], coords[:-1,1][segment], coords[1:,0][segment], coords[1:,1][segment])
+
+    return np.bincount(geometry_index[part_index[:-1][segment]], weights=length, minlength=len(geometries)) #sum segments per geometry
+
+def polygon_area(geometries):
+    """area of (multi)polygons on the ellipsoid
+    Arguments:
+        *geometries*: array with WGS-84 coordinates in Pygeos format
+
+    Returns:
+        array with area of each geometry in m2
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    coords = pygeos.get_coordinates(geometries)
+    if len(coords) == 0:
+        return np.zeros(len(geometries))
+
+    new_coords = EQUAL_AREA.transform(coords[:,0], coords[:,1]) #one transformation for all coordinates
+
+    return pygeos.area(pygeos.set_coordinates(geometries.copy(), np.array(new_coords).T))
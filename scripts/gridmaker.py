@@ -111,4 +111,107 @@ def box_per_df(fetched_data_dict):
                     )))                
 
     bbox_df = pd.DataFrame(res_geoms,columns=['geometry'])
-    return bbox_df
\ No newline at end of file
+    return bbox_df
+
+def grid_lattice(df):
+    """Check whether grids form a regular lattice of square cells (as made by create_grid) and get the position of each grid in that lattice
+    Arguments:
+        *df*: dataframe with grids (in Pygeos geometry) on each row
+        
+    Returns:
+        dictionary with the upper left corner of the lattice (xmin, ymax), the resolution in degrees (height) and a lookup array with the position of the grid in *df* for each row and column of the lattice (-1 if the lattice cell is not in *df*). None if grids do not form a regular lattice
+    """
+    geoms = df.geometry.values
+    if len(geoms) == 0:
+        return None
+    if not (pygeos.get_type_id(geoms) == 3).all() or not (pygeos.get_num_coordinates(geoms) == 5).all(): #only rectangles
+        return None
+
+    bounds = pygeos.bounds(geoms)
+    height = bounds[0,3] - bounds[0,1]
+    tolerance = height * 1e-6
+    if not np.allclose(bounds[:,2] - bounds[:,0], height, rtol=0, atol=tolerance) or not np.allclose(bounds[:,3] - bounds[:,1], height, rtol=0, atol=tolerance):
+        return None
+    if not np.allclose(pygeos.area(geoms), height**2, rtol=1e-6, atol=0): #grids are squares parallel to the axes
+        return None
+
+    xmin, ymax = bounds[:,0].min(), bounds[:,3].max()
+    cols = (bounds[:,0] - xmin) / height
+    rows = (ymax - bounds[:,3]) / height
+    if not np.allclose(cols, np.round(cols), rtol=0, atol=1e-6) or not np.allclose(rows, np.round(rows), rtol=0, atol=1e-6): #grids are aligned
+        return None
+    cols, rows = np.round(cols).astype(np.int64), np.round(rows).astype(np.int64)
+
+    lookup = np.full((rows.max()+1, cols.max()+1), -1, dtype=np.int64)
+    lookup[rows, cols] = np.arange(len(geoms))
+    if (lookup >= 0).sum() != len(geoms): #overlapping grids
+        return None
+
+    return {'xmin': xmin, 'ymax': ymax, 'height': height, 'lookup': lookup}
+
+def lattice_cell(x, y, lattice):
+    """Get the grid in which coordinates are located by arithmetic on a regular lattice (see grid_lattice)
+    Arguments:
+        *x*: array with longitudes
+        *y*: array with latitudes
+        *lattice*: dictionary describing the regular lattice (see grid_lattice)
+        
+    Returns:
+        array with the position of the grid for each coordinate (-1 if the coordinate is not located in one of the grids)
+    """
+    lookup = lattice['lookup']
+    cols = np.floor((np.asarray(x) - lattice['xmin']) / lattice['height'])
+    rows = np.floor((lattice['ymax'] - np.asarray(y)) / lattice['height'])
+    inside = (cols >= 0) & (cols < lookup.shape[1]) & (rows >= 0) & (rows < lookup.shape[0]) #also False for NaN
+
+    cells = np.full(len(cols), -1, dtype=np.int64)
+    cells[inside] = lookup[rows[inside].astype(np.int64), cols[inside].astype(np.int64)]
+
+    return cells
+
+def grid_tiles(df, tile_size):
+    """Split grids into square tiles of *tile_size* degrees. Each grid is assigned to the tile in which its centroid is located, so tiles consist of whole grids and do not overlap
+    Arguments:
+        *df*: dataframe with grids (in Pygeos geometry) on each row
+        *tile_size*: size of the tiles in degrees
+        
+    Returns:
+        tuple with an array with the tile number of each grid in *df* and an array with the bounding box (xmin, ymin, xmax, ymax) of the grids in each tile
+    """
+    centroids = pygeos.centroid(df.geometry.values)
+    x, y = pygeos.get_x(centroids), pygeos.get_y(centroids)
+    cols = np.floor((x - x.min()) / tile_size).astype(np.int64)
+    rows = np.floor((y.max() - y) / tile_size).astype(np.int64)
+    tiles = np.unique(rows * (cols.max() + 1) + cols, return_inverse=True)[1] #number tiles from 0 to n_tiles-1
+
+    bounds = pygeos.bounds(df.geometry.values)
+    tile_bounds = np.column_stack([pd.Series(bounds[:,i]).groupby(tiles).agg(func).values for i, func in enumerate(['min', 'min', 'max', 'max'])])
+
+    return tiles, tile_bounds
+
+def subdivide_mask(geometry, tile_size):
+    """Split a (country) polygon into pieces along square tiles of *tile_size* degrees, aligned with whole degrees. Pieces of tiles that are fully inside *geometry* are the tiles themselves, 
+    pieces of tiles on the boundary are the part of *geometry* within the tile, so each piece has few vertices compared to *geometry*
+    Arguments:
+        *geometry*: (multi)polygon in Pygeos geometry
+        *tile_size*: size of the tiles in degrees
+        
+    Returns:
+        dataframe with a piece of *geometry* (in Pygeos geometry) on each row, the bounds of its tile (xmin, ymin, xmax, ymax) and a column interior which is True for tiles fully inside *geometry*
+    """
+    xmin, ymin, xmax, ymax = pygeos.bounds(geometry)
+    xs = np.arange(np.floor(xmin / tile_size) * tile_size, xmax, tile_size)
+    ys = np.arange(np.floor(ymin / tile_size) * tile_size, ymax, tile_size)
+    x, y = np.meshgrid(xs, ys)
+    tiles = pygeos.box(x.ravel(), y.ravel(), x.ravel() + tile_size, y.ravel() + tile_size)
+
+    pygeos.prepare(geometry)
+    tiles = tiles[pygeos.intersects(geometry, tiles)]
+    interior = pygeos.contains_properly(geometry, tiles)
+    pieces = tiles.copy()
+    pieces[~interior] = pygeos.intersection(geometry, tiles[~interior])
+    keep = ~pygeos.is_empty(pieces) & (pygeos.area(pieces) > 0) #tiles that only touch the boundary
+
+    bounds = pygeos.bounds(tiles[keep])
+
+    return pd.DataFrame({'xmin': bounds[:,0], 'ymin': bounds[:,1], 'xmax': bounds[:,2], 'ymax': bounds[:,3], 'interior': interior[keep], 'geometry': pieces[keep]})
@@ -0,0 +1,213 @@
+"""
+Bookkeeping of model runs: a manifest per area records a fingerprint of the inputs of each stage (e.g. extraction, base calculation).
+A stage of an area is only run again when its fingerprint changed, e.g. because the OSM-file of the area was refreshed, the grid changed or the code was updated.
+Within a stage, each group is checkpointed separately, so a run that is interrupted resumes at the first unfinished group. Outputs and manifests are written atomically, so an interrupted run never leaves incomplete files behind.
+"""
+
+import os
+import json
+import hashlib
+import inspect
+
+HASH_INPUTS = False #if True, the content of input files is hashed as well (slow for large pbf-files). Otherwise size and modification time are used
+
+def file_fingerprint(path, hash_file=HASH_INPUTS):
+    """fingerprint of an input file
+    Arguments:
+        *path*: path to file
+        *hash_file*: if True, the content of the file is hashed as well. Optional, defaults to HASH_INPUTS
+
+    Returns:
+        dictionary with size, modification time (and hash) of file. None if file does not exist
+    """
+    if not os.path.isfile(path):
+        return None
+
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+    if hash_file:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        fingerprint['sha1'] = sha.hexdigest()
+
+    return fingerprint
+
+def code_version(objects):
+    """version of the code that is used in a stage, based on the source code
+    Arguments:
+        *objects*: list with modules and/or functions used in a stage
+
+    Returns:
+        hash of the source code of *objects*
+    """
+    sha = hashlib.sha1()
+    for obj in objects:
+        sha.update(inspect.getsource(obj).encode('utf-8'))
+
+    return sha.hexdigest()
+
+def stage_fingerprint(files=(), spec=None, code=()):
+    """fingerprint of the inputs of a stage
+    Arguments:
+        *files*: list with paths to input files
+        *spec*: specification of the stage (e.g. groups to extract), must be json serializable
+        *code*: list with modules and/or functions used in the stage
+
+    Returns:
+        hash of the input files, specification and code version
+    """
+    inputs = {'files': {os.path.basename(path): file_fingerprint(path) for path in files},
+              'spec': spec,
+              'code': code_version(code)}
+
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def atomic_write(write, path, sidecars=()):
+    """write a file atomically: the file is written to a temporary file next to *path* first, which is moved to *path* when writing is finished
+    Arguments:
+        *write*: function that writes the file, taking the path to write to as argument
+        *path*: path to output file
+        *sidecars*: list with suffixes of files that *write* writes next to the output file (e.g. '.crs'), which are moved as well
+
+    Returns:
+        *path*
+    """
+    root, ext = os.path.splitext(path)
+    temp_path = '{}.tmp{}'.format(root, ext) #keep extension, so drivers that depend on it (e.g. GPKG) still work
+    for temp_file in [temp_path] + [temp_path + suffix for suffix in sidecars]: #remove leftovers of an interrupted run
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+
+    write(temp_path)
+    for suffix in sidecars:
+        if os.path.isfile(temp_path + suffix):
+            os.replace(temp_path + suffix, path + suffix)
+    os.replace(temp_path, path) #output file is moved last, so its existence means that all files are complete
+
+    return path
+
+def group_stage(stage, group):
+    """name of the checkpoint of a group within a stage
+    Arguments:
+        *stage*: name of stage (e.g. 'extraction')
+        *group*: group (e.g. 'power') or sub-system (e.g. 'energy')
+
+    Returns:
+        name of checkpoint, e.g. 'extraction:power'
+    """
+    return '{}:{}'.format(stage, group)
+
+def manifest_path(run_state_path, area):
+    """path to manifest of area
+    Arguments:
+        *run_state_path*: directory with manifests
+        *area*: area (e.g. country)
+
+    Returns:
+        path to json file with manifest of *area*
+    """
+    return os.path.join(run_state_path, '{}_manifest.json'.format(area))
+
+def load_manifest(run_state_path, area):
+    """load manifest of area
+    Arguments:
+        *run_state_path*: directory with manifests
+        *area*: area (e.g. country)
+
+    Returns:
+        dictionary with stages as keys and fingerprints as values (empty if there is no manifest)
+    """
+    path = manifest_path(run_state_path, area)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        print("WARNING: manifest of area '{}' is corrupt and will be ignored".format(area))
+        return {}
+
+def is_up_to_date(run_state_path, area, stage, fingerprint):
+    """check whether a stage of an area has been run with the same inputs
+    Arguments:
+        *run_state_path*: directory with manifests
+        *area*: area (e.g. country)
+        *stage*: name of stage (e.g. 'extraction') or checkpoint of a group (see group_stage)
+        *fingerprint*: fingerprint of the current inputs of the stage
+
+    Returns:
+        True if the manifest contains the same fingerprint for the stage
+    """
+    return load_manifest(run_state_path, area).get(stage) == fingerprint
+
+def record_stage(run_state_path, area, stage, fingerprint):
+    """record that a stage of an area is finished with certain inputs
+    Arguments:
+        *run_state_path*: directory with manifests
+        *area*: area (e.g. country)
+        *stage*: name of stage (e.g. 'extraction') or checkpoint of a group (see group_stage)
+        *fingerprint*: fingerprint of the inputs of the stage
+    """
+    manifest = load_manifest(run_state_path, area)
+    manifest[stage] = fingerprint
+
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    atomic_write(write, manifest_path(run_state_path, area))
+
+def record_runtime(run_state_path, area, stage, seconds):
+    """record the runtime of a stage of an area, used to schedule the areas of the next run (see largest_first)
+    Arguments:
+        *run_state_path*: directory with manifests
+        *area*: area (e.g. country)
+        *stage*: name of stage (e.g. 'extraction')
+        *seconds*: runtime of the stage in seconds
+    """
+    record_stage(run_state_path, area, 'runtime:{}'.format(stage), round(seconds, 1))
+
+def largest_first(areas, run_state_path, stage, sizes, pending=None):
+    """order areas by expected runtime of a stage, longest first, so the largest areas do not end up last in the worker pool
+    Arguments:
+        *areas*: list with areas (e.g. countries) or tiles of areas, as named in the manifests
+        *run_state_path*: directory with manifests
+        *stage*: name of stage (e.g. 'extraction')
+        *sizes*: dictionary with areas as keys and the size of the inputs (e.g. bytes of the pbf-file) as values
+        *pending*: list with the areas for which the stage has to run. Optional, by default the stage has to run for all areas. Other areas will be skipped, so their expected runtime is zero
+
+    Returns:
+        list with *areas*, ordered by recorded runtime. For areas without recorded runtime, the runtime is estimated from the size of the inputs, using the median runtime per unit of size of the other areas
+    """
+    runtimes = {area: load_manifest(run_state_path, area).get('runtime:{}'.format(stage)) for area in areas}
+    rates = sorted(runtimes[area] / sizes[area] for area in areas if runtimes[area] is not None and sizes[area] > 0)
+    rate = rates[len(rates) // 2] if len(rates) > 0 else 1.0
+    cost = {area: runtimes[area] if runtimes[area] is not None else sizes[area] * rate for area in areas}
+    if pending is not None:
+        cost = {area: cost[area] if area in pending else 0 for area in areas}
+
+    return sorted(areas, key=lambda area: cost[area], reverse=True)
+
+def record_outputs(run_state_path, area, stage, files):
+    """record the output files of a stage of an area, so a stage is only skipped when its outputs still exist (see outputs_exist)
+    Arguments:
+        *run_state_path*: directory with manifests
+        *area*: area (e.g. country)
+        *stage*: name of stage (e.g. 'extraction') or checkpoint of a group (see group_stage)
+        *files*: list with paths to the output files (empty if the stage has no outputs, e.g. no infrastructure is found)
+    """
+    record_stage(run_state_path, area, 'outputs:{}'.format(stage), list(files))
+
+def outputs_exist(run_state_path, area, stage):
+    """check whether the recorded output files of a stage of an area still exist
+    Arguments:
+        *run_state_path*: directory with manifests
+        *area*: area (e.g. country)
+        *stage*: name of stage (e.g. 'extraction') or checkpoint of a group (see group_stage)
+
+    Returns:
+        True if outputs are recorded for the stage and all of them exist
+    """
+    files = load_manifest(run_state_path, area).get('outputs:{}'.format(stage))
+    return files is not None and all(os.path.isfile(path) for path in files)